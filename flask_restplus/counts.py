@@ -0,0 +1,123 @@
+import time
+import hashlib
+import threading
+from bson import json_util
+
+"""
+    列表总数计算策略，列表接口通过 count_mode 按需选择：
+        exact       精确计数 count()
+        estimated   无过滤条件时取集合元数据 estimated_document_count，有过滤条件时退回精确计数
+        capped      计数上限，最多数到 上限+1 条，超出上限时 total 为上限、total_capped 为 True(前端展示为 "10000+")
+        cached      以查询条件hash为键缓存精确计数，ttl秒内同一条件不再重复计数
+    传入的查询集应为未分页(未skip/limit)的过滤结果。
+"""
+
+
+class CountStrategy(object):
+    name = None
+
+    def count(self, objs, engine='mongo'):
+        raise NotImplementedError
+
+    def display(self, count):
+        """返回给前端的total，始终为整数"""
+        return count
+
+    def is_capped(self, count):
+        """实际总数是否超出计数上限"""
+        return False
+
+    def total(self, objs, engine='mongo'):
+        return self.display(self.count(objs, engine))
+
+    def info(self, objs, engine='mongo'):
+        """表格格式所需的 total 与 total_capped"""
+        count = self.count(objs, engine)
+        return {'total': self.display(count), 'total_capped': self.is_capped(count)}
+
+
+class ExactCount(CountStrategy):
+    name = 'exact'
+
+    def count(self, objs, engine='mongo'):
+        return objs.count()
+
+
+class EstimatedCount(ExactCount):
+    name = 'estimated'
+
+    def count(self, objs, engine='mongo'):
+        if engine == 'mongo' and not objs._query:
+            return objs._document._get_collection().estimated_document_count()
+        return super(EstimatedCount, self).count(objs, engine)
+
+
+class CappedCount(CountStrategy):
+    name = 'capped'
+
+    def __init__(self, cap=10000):
+        self.cap = cap
+
+    def count(self, objs, engine='mongo'):
+        """多数一条，以区分恰好 cap 条与超出 cap 条"""
+        if engine == 'mongo':
+            return objs.limit(self.cap + 1).count(with_limit_and_skip=True)
+        return objs.limit(self.cap + 1).count()
+
+    def display(self, count):
+        return min(count, self.cap)
+
+    def is_capped(self, count):
+        return count > self.cap
+
+
+class CachedCount(ExactCount):
+    name = 'cached'
+
+    def __init__(self, ttl=60, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(objs, engine='mongo'):
+        if engine == 'mongo':
+            raw = '%s|%s' % (objs._collection.name, json_util.dumps(objs._query, sort_keys=True))
+        else:
+            raw = str(objs.sql())
+        return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+    def count(self, objs, engine='mongo'):
+        key = self.get_key(objs, engine)
+        now = time.time()
+        item = self._cache.get(key)
+        if item and item[1] > now:
+            return item[0]
+        total = super(CachedCount, self).count(objs, engine)
+        with self._lock:
+            if len(self._cache) >= self.max_size:
+                self._cache = {k: v for k, v in self._cache.items() if v[1] > now}
+            self._cache[key] = (total, now + self.ttl)
+        return total
+
+    def clear(self):
+        with self._lock:
+            self._cache = {}
+
+
+COUNT_STRATEGIES = {
+    'exact': ExactCount(),
+    'estimated': EstimatedCount(),
+    'capped': CappedCount(),
+    'cached': CachedCount(),
+}
+
+
+def get_count_strategy(mode='exact'):
+    """
+    :param mode: 策略名 或 CountStrategy 实例(自定义参数，如 CappedCount(cap=5000))
+    """
+    if isinstance(mode, CountStrategy):
+        return mode
+    return COUNT_STRATEGIES[mode]
@@ -1,12 +1,57 @@
 import copy
+from collections import OrderedDict
 from flask_restplus import fields as frp_fields
+from flask_restplus.marshalling import marshal
 from ..flex import current_api
 Model = current_api.model
 
 
+def get_extra_fields(model, serializer):
+    """响应格式中序列化器不输出的字段，如 marshal_table(add_action=True) 增加的 actions"""
+    fields = serializer.fields
+    return OrderedDict((k, v) for k, v in model.items() if k not in fields)
+
+
+def merge_extra_fields(rows, objs, extra_fields, skip_none=False):
+    """逐条marshal额外字段，按模型顺序追加到序列化结果之后"""
+    for row, obj in zip(rows, objs):
+        row.update(marshal(obj, extra_fields, skip_none=skip_none, ordered=True))
+    return rows
+
+
+class SerializedList(frp_fields.List):
+    """
+        文档展示同 List(Nested(model))，输出时直接取序列化器按序列化计划生成的数据，不再逐条marshal
+        模型中序列化器之外的字段(如 actions)仍逐条marshal后合并
+    """
+    def output(self, key, data, ordered=False, **kwargs):
+        serializer = data._serializer_
+        skip_none = self.container.skip_none
+        rows = serializer.serialize(skip_none=skip_none)
+        extra_fields = get_extra_fields(self.container.model, serializer)
+        if extra_fields and rows:
+            objs = serializer._objs_ if serializer._objs_ is not None else (serializer._instance_ or [])
+            merge_extra_fields(rows, objs, extra_fields, skip_none)
+        return rows
+
+
+class SerializedNested(frp_fields.Nested):
+    """
+        文档展示同 Nested(model)，输出时直接取序列化器按序列化计划生成的数据
+    """
+    def output(self, key, obj, ordered=False, **kwargs):
+        serializer = obj._serializer_
+        row = serializer.serialize(skip_none=self.skip_none)
+        extra_fields = get_extra_fields(self.model, serializer)
+        if extra_fields and serializer._instance_:
+            merge_extra_fields([row], [serializer._instance_], extra_fields, self.skip_none)
+        return row
+
+
 class BaseTable(object):
     TABLE_FORMAT = {
         'total': frp_fields.Integer,
+        'total_capped': frp_fields.Boolean(description='total 是否为计数上限(实际总数更多)'),
         'page': frp_fields.Integer(attribute='page'),
         'page_size': frp_fields.Integer(),
     }
@@ -17,7 +62,7 @@ class BaseTable(object):
                 pargs
                 page, page_size
                 两种形式的输入
-            表格信息 默认支持 code, message, total 参数
+            表格信息 默认支持 code, message, total, total_capped 参数
             表格额外信息 支持任意参数，但必须写好format，以便api文档展示
 
         :param _serializer_:
@@ -35,7 +80,9 @@ class BaseTable(object):
         else:
             self.model = _serializer_.Meta.model
             self.message = "%s列表" % (self.model._model_desc_ or self.model.__class__.__name__)
-        self.total = kwargs.pop('total', None) or len(self._items)
+        total = kwargs.pop('total', None)
+        self.total = total if total is not None else len(self._items)
+        self.total_capped = kwargs.pop('total_capped', False)
         self.add_action = kwargs.pop('add_action', False)
         pargs = kwargs.pop('pargs', None)
         if pargs:
@@ -67,13 +114,13 @@ class BaseTable(object):
     def get_fields(cls, serializer_cls, name=None, add_action=True, skip_none=True, format={}):
         if name is None:
             name = 'Table%s' % (serializer_cls,)
-        model_fields = copy.deepcopy(serializer_cls(_many_=True).fields)
+        model_fields = OrderedDict(serializer_cls.fields)
         if add_action:
             model_fields['actions'] = frp_fields.List(frp_fields.String)
         model = Model('ListItem%s' % (serializer_cls.__name__,), model_fields)
         res = copy.copy(cls.TABLE_FORMAT)
         res.update(format)
-        res['data'] = frp_fields.List(frp_fields.Nested(model, skip_none=skip_none), attribute='_items')
+        res['data'] = SerializedList(frp_fields.Nested(model, skip_none=skip_none), attribute='_items')
         return Model(name, res)
 
 
@@ -118,8 +165,8 @@ class BaseResponse(object):
             name = 'Response%s' % (serializer_cls,)
         res = copy.copy(cls.FORMAT)
         res.update(format)
-        res['data'] = frp_fields.Nested(serializer_cls(**kwargs).fields_model(), attribute='_item',
-                                        skip_none=kwargs.get('skip_none', False))
+        res['data'] = SerializedNested(serializer_cls(**kwargs).fields_model(), attribute='_item',
+                                       skip_none=kwargs.get('skip_none', False))
         return Model(name, res)
 
 
@@ -129,11 +176,11 @@ class ListResponseMixin:
         if name is None:
             name = 'Response%s' % (serializer_cls,)
         res = copy.copy(cls.FORMAT)
-        model_fields = copy.deepcopy(serializer_cls().fields)
+        model_fields = OrderedDict(serializer_cls.fields)
         model = Model('ListItem%s' % (serializer_cls.__name__,), model_fields)
         res.update(format)
-        res['data'] = frp_fields.List(frp_fields.Nested(model, skip_none=kwargs.get('skip_none', False)),
-                                      attribute='_item')
+        res['data'] = SerializedList(frp_fields.Nested(model, skip_none=kwargs.get('skip_none', False)),
+                                     attribute='_item')
         return Model(name, res)
 
 
@@ -1,6 +1,11 @@
 # from abc import abstractmethod
+import base64
+import operator
 import regex
+from functools import reduce
 from collections import OrderedDict
+from datetime import date, datetime
+from bson import ObjectId, json_util
 from werkzeug.exceptions import abort, BadRequest
 from flask_restplus import Resource as Resource_
 from flask import request
@@ -9,6 +14,7 @@ from flask_login import login_required
 from ..webbase.http_utils import get_object_or_404
 from ..webbase.response import JsonResponse
 from ..widgets.decorators import request_logging
+from .counts import get_count_strategy
 from ..flex import current_flex
 DEFAULT_ENGINE = current_flex.db_engine
 _regist_decorators = {}
@@ -192,6 +198,7 @@ class AbSingleResource(AbResource):
 class AbListResource(AbResource):
     model_class = None
     model_serializer = None
+    count_mode = 'exact'  # 总数计算策略，见 counts.py：exact/estimated/capped/cached 或 CountStrategy 实例
     method_decorators = AbResource.method_decorators + [login_required]
     # methods = ['get', 'post']
     parameterized_decorators = {
@@ -206,8 +213,26 @@ class AbListResource(AbResource):
     def msg_add_success(self):
         return '新增 %s 成功' % self.model_class._model_desc_
 
-    def order_paginate(self, objs, pargs):
-        return model_order_paginate(self.model_class, objs, pargs, self.Meta.engine)
+    def get_only_fields(self):
+        """列表序列化器所需的数据库字段，用于查询投影；None 表示加载全部字段"""
+        if self.model_serializer is None or not hasattr(self.model_serializer, 'get_db_fields'):
+            return None
+        return self.model_serializer.get_db_fields()
+
+    def order_paginate(self, objs, pargs, lazy=False):
+        return model_order_paginate(self.model_class, objs, pargs, self.Meta.engine, lazy=lazy,
+                                    only=self.get_only_fields())
+
+    def count(self, objs):
+        """按 count_mode 计算过滤结果总数，objs 为未分页的查询集"""
+        return get_count_strategy(self.count_mode).total(objs, self.Meta.engine)
+
+    def count_info(self, objs):
+        """{'total': 总数, 'total_capped': 是否超出计数上限}，可直接传给 serializer.table(**info)"""
+        return get_count_strategy(self.count_mode).info(objs, self.Meta.engine)
+
+    def cursor_paginate(self, objs, pargs):
+        return model_cursor_paginate(self.model_class, objs, pargs, self.Meta.engine, only=self.get_only_fields())
 
     def get_operation_msg(self, objs):
         def _get_desc(objs):
@@ -219,10 +244,12 @@ class AbListResource(AbResource):
         return ACTIONS[request.method] % _get_desc(objs)
 
 
-def model_order_paginate(model_class, objs, pargs, engine=DEFAULT_ENGINE):
+def model_order_paginate(model_class, objs, pargs, engine=DEFAULT_ENGINE, lazy=False, only=None):
     """
     :param objs:
     :param pargs: pargs.order_fields  # like "id,-create_time"
+    :param lazy: 返回查询集而不是列表，配合 StreamTableResponse 流式输出
+    :param only: 仅加载的字段(mongo投影)，通常取自 ModelSerializer.get_db_fields()
     :return:
     """  # todo@hy filter order_fields的正则校验
     if engine == 'peewee':
@@ -243,15 +270,151 @@ def model_order_paginate(model_class, objs, pargs, engine=DEFAULT_ENGINE):
         objs = objs.order_by(*fields)
         if pargs.page_size != -1:
             objs = objs.paginate(pargs.page, pargs.page_size)
-        return list(objs)
+        return objs if lazy else list(objs)
     elif engine == 'mongo':
+        if only:
+            objs = objs.only(*only)
         if hasattr(pargs, 'order_fields') and pargs.order_fields is not None:
             objs = objs.order_by(pargs.order_fields)
         if pargs.page_size < -1:
             raise BadRequest('page_size(页长）不能小于-1')
         elif pargs.page_size == -1:
-            return list(objs)
-        return list(objs.skip((pargs.page - 1) * pargs.page_size).limit(pargs.page_size))
+            return objs if lazy else list(objs)
+        objs = objs.skip((pargs.page - 1) * pargs.page_size).limit(pargs.page_size)
+        return objs if lazy else list(objs)
+
+
+def _encode_cursor_value(value):
+    """json_util 将 datetime 截断到毫秒，游标中的日期以 isoformat 原样保存"""
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'$d': value.isoformat()}
+    return value
+
+
+def _decode_cursor_value(value):
+    if isinstance(value, dict) and len(value) == 1:
+        if '$dt' in value:
+            return datetime.fromisoformat(value['$dt'])
+        if '$d' in value:
+            return date.fromisoformat(value['$d'])
+    return value
+
+
+def encode_cursor(values):
+    values = [_encode_cursor_value(v) for v in values]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii')
+
+
+# 游标中允许的值类型，解码后直接进入查询条件，字典/列表等可能携带查询操作符(如 {"$ne": ...})，一律拒绝
+CURSOR_VALUE_TYPES = (type(None), bool, int, float, str, datetime, date, ObjectId)
+
+
+def decode_cursor(cursor):
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        values = [_decode_cursor_value(v) for v in values] if isinstance(values, list) else None
+    except Exception:
+        values = None
+    if values is None or not all(isinstance(v, CURSOR_VALUE_TYPES) for v in values):
+        raise BadRequest('cursor(游标)无效')
+    return values
+
+
+def parse_order_fields(order_string):
+    """
+    :param order_string: like "id,-create_time"
+    :return: [(key, desc)]
+    """
+    res = []
+    for order_field in (order_string or '').split(','):
+        order_field = order_field.strip()
+        if not order_field:
+            continue
+        desc = order_field.startswith('-')
+        res.append((order_field[1:] if desc else order_field.lstrip('+'), desc))
+    return res
+
+
+def _keyset_clauses(keys, values, eq, gt, lt):
+    """
+        复合排序键的游标条件: (k1 > v1) or (k1 == v1 and k2 > v2) or ...
+    :param keys: [(key, desc)]
+    """
+    clauses = []
+    for i, (key, desc) in enumerate(keys):
+        clause = [eq(keys[j][0], values[j]) for j in range(i)]
+        clause.append(lt(key, values[i]) if desc else gt(key, values[i]))
+        clauses.append(clause)
+    return clauses
+
+
+def model_cursor_paginate(model_class, objs, pargs, engine=DEFAULT_ENGINE, only=None):
+    """
+        游标(keyset)分页，避免 skip 深翻页的 O(offset) 开销
+        按 pargs.order_fields 排序，主键兜底保证顺序唯一；排序字段不应为空值
+    :param pargs: pargs.order_fields, pargs.page_size, pargs.cursor(上一页返回的next_cursor，首页不传)
+    :param only: 仅加载的字段(mongo投影)，排序字段会自动加入
+    :return: (items, next_cursor) 没有下一页时 next_cursor 为 None
+    """
+    page_size = pargs.page_size
+    if page_size is None or page_size < 1:
+        raise BadRequest('游标分页 page_size(页长) 必须大于0')
+    cursor = getattr(pargs, 'cursor', None)
+    values = decode_cursor(cursor) if cursor else None
+    order_fields = parse_order_fields(getattr(pargs, 'order_fields', None))
+    if engine == 'peewee':
+        pk = model_class._meta.primary_key
+        keys = []
+        for key_name, desc in order_fields:
+            if key_name not in model_class._meta.fields:
+                abort(400, "{} order fields error".format(key_name))
+            keys.append((key_name, desc))
+        if pk.name not in [k for k, _ in keys]:
+            keys.append((pk.name, False))
+        objs = objs.order_by(*(getattr(model_class, k).desc() if desc else getattr(model_class, k).asc()
+                               for k, desc in keys))
+        if values is not None:
+            if len(values) != len(keys):
+                raise BadRequest('cursor(游标)与排序字段不匹配')
+            clauses = _keyset_clauses(keys, values,
+                                      lambda k, v: getattr(model_class, k) == v,
+                                      lambda k, v: getattr(model_class, k) > v,
+                                      lambda k, v: getattr(model_class, k) < v)
+            objs = objs.where(reduce(operator.or_, [reduce(operator.and_, c) for c in clauses]))
+        items = list(objs.limit(page_size + 1))
+        get_value = lambda obj, k: obj.__data__.get(k)
+    elif engine == 'mongo':
+        keys = []
+        for key_name, desc in order_fields:
+            if key_name in ('id', 'pk', '_id'):
+                key_name = 'id'
+            elif key_name not in model_class._fields:
+                abort(400, "{} order fields error".format(key_name))
+            keys.append((key_name, desc))
+        if 'id' not in [k for k, _ in keys]:
+            keys.append(('id', False))
+        if only:
+            objs = objs.only(*OrderedDict.fromkeys(list(only) + [k for k, _ in keys]))
+        objs = objs.order_by(*[('-' if desc else '') + k for k, desc in keys])
+        db_keys = [(model_class._fields[k].db_field if k != 'id' else '_id', desc) for k, desc in keys]
+        if values is not None:
+            if len(values) != len(keys):
+                raise BadRequest('cursor(游标)与排序字段不匹配')
+            clauses = _keyset_clauses(db_keys, values,
+                                      lambda k, v: (k, v),
+                                      lambda k, v: (k, {'$gt': v}),
+                                      lambda k, v: (k, {'$lt': v}))
+            objs = objs.filter(__raw__={'$or': [dict(c) for c in clauses]})
+        items = list(objs.limit(page_size + 1))
+        get_value = lambda obj, k: obj.pk if k == 'id' else model_class._fields[k].to_mongo(getattr(obj, k))
+    else:
+        raise BadRequest('不支持的数据库引擎 %s' % engine)
+    if len(items) <= page_size:
+        return items, None
+    items = items[:page_size]
+    return items, encode_cursor([get_value(items[-1], k) for k, _ in keys])
 
 
 class AbActionResource(AbResource):
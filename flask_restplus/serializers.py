@@ -1,4 +1,5 @@
 import copy
+from types import MappingProxyType
 from collections import OrderedDict
 
 import six
@@ -6,6 +7,7 @@ from flask_restplus import fields as frp_fields
 from flask_restplus.fields import Raw
 from exlib.widgets.decorators import cached_property
 from flask_restplus.marshalling import marshal
+from exlib.flask_restplus.serializers.plan import get_plan, run_plan
 from .fields import DateLocal
 from .formats import Model
 import logging
@@ -63,31 +65,44 @@ class Serializer(object):
     def fields(self):
         """
         A dictionary of {field_name: field_instance}.OrderedDict
+        每个类只构建一次且只读，get_%s 的取值重定向记录在序列化计划中
         """
-        if not hasattr(self, '_fields'):
-            self._fields = OrderedDict([])
-            for key, value in self.get_fields().items():
-                self._fields[key] = value
-                if hasattr(self, 'get_%s' % key):
-                    value.attribute = '__func__%s' % key
-        return self._fields
+        cls = self.__class__
+        if '_fields' not in cls.__dict__:
+            cls._fields = MappingProxyType(OrderedDict(self.get_fields()))
+        return cls._fields
+
+    @property
+    def hook_fields(self):
+        return tuple(key for key in self.fields
+                     if hasattr(self, 'get_%s' % key) or hasattr(self, 'get_many_%s' % key))
 
     def parse_data_item(self, obj):
-        for field in self.fields:
-            if hasattr(self, 'get_%s' % field):
-                func = getattr(self, 'get_%s' % field)
-                setattr(obj, '__func__%s' % field, func(obj, field))
+        """逐条调用 get_%s(obj, field)，结果写入以对象id为键的旁路表，不再写到对象上"""
+        row = self._computed_.setdefault(id(obj), {})
+        for field in self.hook_fields:
+            if field in row or not hasattr(self, 'get_%s' % field):
+                continue
+            row[field] = getattr(self, 'get_%s' % field)(obj, field)
+
+    def parse_data_batch(self, objs):
+        """批量钩子：get_many_%s(objs) 一次返回整页数据的值(与objs顺序一致)"""
+        for field in self.hook_fields:
+            if hasattr(self, 'get_many_%s' % field):
+                values = getattr(self, 'get_many_%s' % field)(objs)
+                for obj, value in zip(objs, values):
+                    self._computed_.setdefault(id(obj), {})[field] = value
 
     def prepare_data(self):
         """parse_data_item进行数据准备，以免在marshal data时重复查询数据库"""
         return
 
     def handle_data(self):
-        if not self.many:
-            self.parse_data_item(self._instance_)
-        else:
-            for i in self._instance_:
-                self.parse_data_item(i)
+        self._computed_ = {}
+        self._objs_ = list(self._instance_) if self.many else [self._instance_]
+        self.parse_data_batch(self._objs_)
+        for i in self._objs_:
+            self.parse_data_item(i)
 
     @property
     def data(self):
@@ -95,14 +110,22 @@ class Serializer(object):
             return [] if self.many else {}
         self.prepare_data()
         self.handle_data()
+        plan = get_plan(self.__class__, self.fields, self.skip_none, self.hook_fields)
+        if plan is None:
+            fields = OrderedDict(self.fields)
+            for key in self.hook_fields:
+                fields[key] = copy.copy(fields[key]() if isinstance(fields[key], type) else fields[key])
+                fields[key].attribute = lambda obj, key=key: self._computed_.get(id(obj), {}).get(key)
+            if not self.many:
+                return marshal(self._instance_, fields, ordered=True, skip_none=self.skip_none)
+            return [marshal(item, fields, ordered=True, skip_none=self.skip_none) for item in self._objs_]
         if not self.many:
-            return marshal(self._instance_, self.fields, ordered=True, skip_none=self.skip_none)
-        else:
-            return [marshal(item, self.fields, ordered=True, skip_none=self.skip_none) for item in self._instance_]
+            return run_plan(plan, self._instance_, self.skip_none, self._computed_.get(id(self._instance_)))
+        return [run_plan(plan, item, self.skip_none, self._computed_.get(id(item))) for item in self._objs_]
 
     @classmethod
     def get_fields(cls):
-        return copy.deepcopy(cls._declared_fields)
+        return OrderedDict(cls._declared_fields)
 
     def fields_model(self, name=None):
         if not name:
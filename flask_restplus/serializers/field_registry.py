@@ -0,0 +1,134 @@
+import threading
+from collections import OrderedDict
+from flask_restplus import fields as frp_fields
+from ...flex import current_api
+
+"""
+    模型字段 -> restplus 字段 的全局注册表。
+    每个 mongoengine/peewee 文档类的字段按需逐个映射并缓存，只映射序列化器用到的字段，
+    EmbeddedDocument 只在被用到时生成一次 Model，swagger 文档生成和首个请求不再重复构建映射。
+    缓存以类的全名、映射方法及参数为键并记录类对象本身，类被重新定义(同名新类)时自动重建；也可用 invalidate 主动清除。
+"""
+
+
+class FieldRegistry(object):
+    def __init__(self):
+        self._mappings = {}
+        self._fields = {}
+        self._models = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def get_key(document_cls, variant=None):
+        return document_cls.__module__ + '.' + document_cls.__name__, variant
+
+    @staticmethod
+    def get_func_key(field_func):
+        """映射方法的缓存键，绑定方法每次取值都是新对象，取其底层函数"""
+        return getattr(field_func, '__func__', field_func)
+
+    def get_mapping(self, engine, datetime_field=None):
+        key = (engine, datetime_field)
+        if key not in self._mappings:
+            self._mappings[key] = build_pw_mapping() if engine == 'peewee' else build_mge_mapping(datetime_field)
+        return self._mappings[key]
+
+    def _get_cached(self, cache, key, document_cls, build):
+        item = cache.get(key)
+        if item is not None and item[0] is document_cls:
+            return item[1]
+        with self._lock:
+            item = cache.get(key)
+            if item is None or item[0] is not document_cls:
+                item = (document_cls, build())
+                cache[key] = item
+        return item[1]
+
+    def get_fields(self, document_cls, engine, field_func, variant=None, names=None):
+        """
+            文档类的字段映射 {field_name: restplus field}，未映射过的字段在此时映射
+        :param field_func: 单个模型字段的映射方法，如 ModelSerializer.get_base_fields_by_mge_field
+        :param variant: 影响映射结果的参数(如默认日期字段类型)，不同取值分别缓存
+        :param names: 需要的字段名，None 表示全部字段；不是模型字段的名称忽略
+        """
+        model_fields = document_cls._meta.fields if engine == 'peewee' else document_cls._fields
+        names = list(model_fields) if names is None else [name for name in names if name in model_fields]
+        key = self.get_key(document_cls, (engine, variant, self.get_func_key(field_func)))
+        mapped = self._get_cached(self._fields, key, document_cls, dict)
+        missing = [name for name in names if name not in mapped]
+        if missing:
+            with self._lock:
+                for name in missing:
+                    if name not in mapped:
+                        mapped[name] = field_func(model_fields[name])
+        return OrderedDict((name, mapped[name]) for name in names)
+
+    def get_model(self, document_cls, field_func, variant=None, api=None):
+        """EmbeddedDocument 对应的 restplus Model，仅支持mongoengine"""
+        def build():
+            name = 'EmbeddedDocument %s' % (document_cls.__module__ + '.' + document_cls.__name__,)
+            fields = self.get_fields(document_cls, 'mongo', field_func, variant)
+            return (api or current_api).model(name, dict(fields))
+        key = self.get_key(document_cls, (variant, self.get_func_key(field_func)))
+        return self._get_cached(self._models, key, document_cls, build)
+
+    def invalidate(self, document_cls=None):
+        with self._lock:
+            if document_cls is None:
+                self._fields.clear()
+                self._models.clear()
+                return
+            name = self.get_key(document_cls)[0]
+            for cache in (self._fields, self._models):
+                for key in [k for k in cache if k[0] == name]:
+                    del cache[key]
+
+
+def build_pw_mapping():
+    import peewee as pw
+    return dict([(pw.AutoField, frp_fields.Integer),
+                 (pw.BareField, frp_fields.String),
+                 (pw.BigAutoField, frp_fields.Integer),
+                 (pw.BigBitField, frp_fields.String),
+                 (pw.BigIntegerField, frp_fields.Integer),
+                 (pw.BinaryUUIDField, frp_fields.String),
+                 (pw.BitField, frp_fields.String),
+                 (pw.BlobField, frp_fields.String),
+                 (pw.BooleanField, frp_fields.Boolean),
+                 (pw.CharField, frp_fields.String),
+                 (pw.DateField, frp_fields.Date),
+                 (pw.DateTimeField, frp_fields.DateTime),
+                 (pw.DecimalField, frp_fields.Decimal),
+                 (pw.DoubleField, frp_fields.Decimal),
+                 (pw.FixedCharField, frp_fields.String),
+                 (pw.FloatField, frp_fields.Float),
+                 # (pw.ForeignKeyField, frp_fields.)
+                 (pw.IntegerField, frp_fields.Integer),
+                 (pw.IPField, frp_fields.String),
+                 # (pw.ManyToManyField, frp_fields)
+                 (pw.SmallIntegerField, frp_fields.Integer),
+                 (pw.TextField, frp_fields.String),
+                 (pw.TimeField, frp_fields.DateTime),
+                 (pw.TimestampField, frp_fields.Integer),
+                 (pw.UUIDField, frp_fields.String)])
+
+
+def build_mge_mapping(datetime_field):
+    import mongoengine as mge
+    return dict([(mge.StringField, frp_fields.String),
+                 (mge.URLField, frp_fields.String),
+                 (mge.EmailField, frp_fields.String),
+                 (mge.IntField, frp_fields.Integer),
+                 (mge.LongField, frp_fields.Integer),
+                 (mge.FloatField, frp_fields.Float),
+                 (mge.DecimalField, frp_fields.Float),
+                 (mge.BooleanField, frp_fields.Boolean),
+                 (mge.DateField, frp_fields.Date),
+                 (mge.DateTimeField, datetime_field),
+                 (mge.ComplexDateTimeField, frp_fields.DateTime),
+                 (mge.ObjectIdField, frp_fields.String)
+                 # todo mongoengine 有一堆不容易获取的类型
+                 ])
+
+
+field_registry = FieldRegistry()
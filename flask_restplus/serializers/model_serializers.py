@@ -1,10 +1,14 @@
+import copy
 from collections import OrderedDict
 from flask_restplus import fields as frp_fields
+from flask_restplus.fields import get_value
 from flask_restplus.marshalling import marshal
 from ...widgets.decorators import cached_property
 from ...flask_restplus.fields import DateLocal
 from ...widgets.decorators import class_property
 from .serializers import Serializer, ALL_FIELDS, logger, _serializer_registry
+from .plan import get_plan
+from .field_registry import field_registry
 
 
 class ModelSerializer(Serializer):
@@ -17,16 +21,20 @@ class ModelSerializer(Serializer):
     def __init__(self, instance=None, **kwargs):
         """
         :param instance: 待转化对象
-        :param kwargs:
+        :param kwargs: _raw_=True 表示 instance 为 as_pymongo() 得到的原始字典(仅mongoengine)，不构建Document对象
         """
         # super(ModelSerializer, self).__init__(**kwargs)
         kwargs.pop('_many_', None)
+        self.raw = kwargs.pop('_raw_', False)
         self._instance_ = instance
         self.name = self.__class__.__module__ + '.' + self.__class__.__name__
         for k, v in kwargs.items():
             setattr(self, k, v)
         self.many = self.get_many()
         self.skip_none = kwargs.pop('_skip_none_', False)
+        self._handled_ = False
+        self._computed_ = {}
+        self._objs_ = None
         _serializer_registry[self.__class__.__module__ + '.' + self.__class__.__name__] = self.__class__
 
     def get_many(self):
@@ -73,8 +81,14 @@ class ModelSerializer(Serializer):
         :param cls:
         :return:
         """
-        name = 'EmbeddedDocument %s' % (target_cls.__module__ + '.' + target_cls.__name__,)
-        return cls._api.model(name, {key: cls.get_base_fields_by_mge_field(target_cls._fields[key]) for key in target_cls._fields})
+        return field_registry.get_model(target_cls, cls.get_base_fields_by_mge_field, cls.default_datetimefield,
+                                        api=getattr(cls, '_api', None))
+
+    @classmethod
+    def get_model_fields(cls, names=None):
+        """Meta.model 的字段映射，经全局注册表每个字段只映射一次；names 为 None 时取全部字段"""
+        return field_registry.get_fields(cls.Meta.model, cls.engine, cls.get_mapping_field_func(),
+                                         cls.default_datetimefield, names=names)
 
     @classmethod
     def get_all_fields_func(cls):
@@ -205,15 +219,182 @@ class ModelSerializer(Serializer):
         self.meta_ready
         model = getattr(self.Meta, 'model')
         field_names = self.get_field_names()
+        model_fields = self.get_model_fields([name for name in field_names if name not in self._declared_fields])
         fields = OrderedDict()
         for field_name in field_names:
             if field_name in self._declared_fields:
                 fields[field_name] = self._declared_fields[field_name]
+            elif field_name in model_fields:
+                fields[field_name] = model_fields[field_name]
             else:
                 model_field = getattr(model, field_name)
                 fields[field_name] = self.get_mapping_field_func()(model_field)
         return fields
 
+    @classmethod
+    def get_raw_fields(cls):
+        """
+            原始字典(as_pymongo)序列化所用字段，每个类只计算一次
+            可直接从字典取值的字段，attribute 改写为数据库字段名；
+            钩子字段及无法直接取值的字段(引用、Decimal、属性方法等)记入 hydrate_keys，需构建Document后取值
+        :return: (fields, hydrate_keys)
+        """
+        if '_raw_fields' not in cls.__dict__:
+            model = cls.Meta.model
+            hooks = cls.hook_fields
+            fields = OrderedDict()
+            hydrate_keys = []
+            defaults = OrderedDict()
+            for key, field in cls.fields.items():
+                if isinstance(field, type):
+                    field = field()
+                db_field = None if key in hooks else cls._get_raw_db_field(key, field, model)
+                if db_field is None:
+                    hydrate_keys.append(key)
+                    fields[key] = field
+                else:
+                    mongo_field = model._fields[getattr(field, 'attribute', None) or key]
+                    if mongo_field.default is not None and not mongo_field.null:
+                        defaults[db_field] = mongo_field.default
+                    fields[key] = copy.copy(field)
+                    fields[key].attribute = db_field
+            cls._raw_defaults = tuple(defaults.items())
+            cls._raw_fields = (fields, tuple(hydrate_keys))
+        return cls._raw_fields
+
+    @classmethod
+    def get_raw_defaults(cls):
+        """
+            直接从字典取值的字段中有默认值的部分 ((db_field, default), ...)
+            原始字典缺少该键或值为None时，构建Document会取默认值，原始字典模式需同样补齐
+        """
+        cls.get_raw_fields()
+        return cls._raw_defaults
+
+    @staticmethod
+    def fill_raw_defaults(rows, defaults):
+        for row in rows:
+            for db_field, default in defaults:
+                if row.get(db_field) is None:
+                    row[db_field] = default() if callable(default) else copy.copy(default)
+
+    @classmethod
+    def _get_raw_db_field(cls, key, field, document_cls):
+        attribute = getattr(field, 'attribute', None) or key
+        if not isinstance(attribute, str) or '.' in attribute or attribute not in document_cls._fields:
+            return None
+        mongo_field = document_cls._fields[attribute]
+        if not cls._is_raw_safe(mongo_field):
+            return None
+        return mongo_field.db_field
+
+    @classmethod
+    def _is_raw_safe(cls, mongo_field):
+        """原始值经restplus字段格式化后，与Document取值后格式化结果一致的字段类型"""
+        import mongoengine as mge
+        while isinstance(mongo_field, mge.ListField):
+            if mongo_field.field is None:
+                return False
+            mongo_field = mongo_field.field
+        if isinstance(mongo_field, mge.EmbeddedDocumentField):
+            # 内嵌文档缺少的键由Document补默认值，原始字典无法逐层补齐，内层有默认值时不走原始字典
+            document_cls = mongo_field.document_type
+            return all(name == f.db_field and cls._is_raw_safe(f) and (f.default is None or f.null)
+                       for name, f in document_cls._fields.items())
+        return type(mongo_field) in (mge.StringField, mge.URLField, mge.EmailField, mge.IntField, mge.LongField,
+                                     mge.FloatField, mge.BooleanField, mge.DateTimeField, mge.DateField,
+                                     mge.ObjectIdField)
+
+    def get_plan(self, skip_none=None):
+        if not self.raw:
+            return super(ModelSerializer, self).get_plan(skip_none)
+        skip_none = self.skip_none if skip_none is None else skip_none
+        fields, hydrate_keys = self.get_raw_fields()
+        return get_plan(self.__class__, fields, skip_none, hydrate_keys, variant='raw')
+
+    def compute_hooks(self, objs):
+        """
+            原始字典模式下，先补齐有默认值字段的缺失值，
+            仅当存在需构建Document取值的字段时才构建，结果按原始字典的id写入旁路表
+        """
+        if not self.raw:
+            return super(ModelSerializer, self).compute_hooks(objs)
+        defaults = self.get_raw_defaults()
+        if defaults:
+            self.fill_raw_defaults(objs, defaults)
+        fields, hydrate_keys = self.get_raw_fields()
+        if not hydrate_keys:
+            return
+        model = self.Meta.model
+        docs = [model._from_son(row) for row in objs]
+        super(ModelSerializer, self).compute_hooks(docs)
+        hooks = self.hook_fields
+        for row, doc in zip(objs, docs):
+            computed = self._computed_.pop(id(doc), {})
+            for key in hydrate_keys:
+                if key not in hooks:
+                    computed[key] = get_value(fields[key].attribute or key, doc)
+            self._computed_[id(row)] = computed
+
+    @classmethod
+    def get_db_fields(cls):
+        """
+            响应所需的数据库字段(Nested字段展开为点路径)，供列表查询 only() 投影，仅支持mongoengine
+            get_%s 钩子依赖的字段需在 Meta.extra_db_fields 中声明，未声明时无法确定依赖，返回 None(不投影)
+            字段取自属性(property)、方法等非模型字段时同样返回 None
+        """
+        if '_db_fields' not in cls.__dict__:
+            cls._db_fields = cls._collect_db_fields()
+        return cls._db_fields
+
+    @classmethod
+    def _collect_db_fields(cls):
+        if cls.engine != 'mongo':
+            return None
+        extra = getattr(cls.Meta, 'extra_db_fields', None)
+        hooks = cls.hook_fields
+        if hooks and extra is None:
+            return None
+        paths = ['id'] + list(extra or [])
+        for key, field in cls.fields.items():
+            if key in hooks:
+                continue
+            field_paths = cls._get_field_db_paths(key, field, cls.Meta.model)
+            if field_paths is None:
+                return None
+            paths.extend(field_paths)
+        return tuple(OrderedDict.fromkeys(paths))
+
+    @classmethod
+    def _get_field_db_paths(cls, key, field, document_cls):
+        import mongoengine as mge
+        if isinstance(field, type):
+            field = field()
+        attribute = getattr(field, 'attribute', None) or key
+        if callable(attribute):
+            return None
+        top = attribute.split('.', 1)[0]
+        if top in ('id', 'pk'):
+            return ['id']
+        if top not in document_cls._fields:
+            return None
+        if '.' in attribute:
+            return [attribute]
+        mongo_field = document_cls._fields[top]
+        while isinstance(mongo_field, mge.ListField) and mongo_field.field is not None:
+            mongo_field = mongo_field.field
+        while isinstance(field, frp_fields.List):
+            field = field.container
+        if isinstance(field, frp_fields.Nested) and isinstance(mongo_field, mge.EmbeddedDocumentField):
+            sub_paths = []
+            for sub_key, sub_field in field.nested.items():
+                res = cls._get_field_db_paths(sub_key, sub_field, mongo_field.document_type)
+                if res is None:
+                    return [attribute]
+                sub_paths.extend(['%s.%s' % (attribute, i) for i in res if i != 'id'])
+            return sub_paths or [attribute]
+        return [attribute]
+
     def check_error_fields(self):
         items = self.Meta.model.objects.all()
         fields = self.fields
@@ -227,33 +408,7 @@ class ModelSerializer(Serializer):
 
     @classmethod
     def get_base_fields_by_pw_field(cls, pw_field):
-        import peewee as pw
-        FieldsMapping = dict([(pw.AutoField, frp_fields.Integer),
-                              (pw.BareField, frp_fields.String),
-                              (pw.BigAutoField, frp_fields.Integer),
-                              (pw.BigBitField, frp_fields.String),
-                              (pw.BigIntegerField, frp_fields.Integer),
-                              (pw.BinaryUUIDField, frp_fields.String),
-                              (pw.BitField, frp_fields.String),
-                              (pw.BlobField, frp_fields.String),
-                              (pw.BooleanField, frp_fields.Boolean),
-                              (pw.CharField, frp_fields.String),
-                              (pw.DateField, frp_fields.Date),
-                              (pw.DateTimeField, frp_fields.DateTime),
-                              (pw.DecimalField, frp_fields.Decimal),
-                              (pw.DoubleField, frp_fields.Decimal),
-                              (pw.FixedCharField, frp_fields.String),
-                              (pw.FloatField, frp_fields.Float),
-                              # (pw.ForeignKeyField, frp_fields.)
-                              (pw.IntegerField, frp_fields.Integer),
-                              (pw.IPField, frp_fields.String),
-                              # (pw.ManyToManyField, frp_fields)
-                              (pw.SmallIntegerField, frp_fields.Integer),
-                              (pw.TextField, frp_fields.String),
-                              (pw.TimeField, frp_fields.DateTime),
-                              (pw.TimestampField, frp_fields.Integer),
-                              (pw.UUIDField, frp_fields.String)])
-        return FieldsMapping.get(type(pw_field), frp_fields.String)
+        return field_registry.get_mapping('peewee').get(type(pw_field), frp_fields.String)
 
     @classmethod
     def get_base_fields_by_mge_field(cls, mongo_field):
@@ -275,20 +430,7 @@ class ModelSerializer(Serializer):
                 res = res(f)
             return res
 
-        FieldsMapping = dict([(mge.StringField, frp_fields.String),
-                              (mge.URLField, frp_fields.String),
-                              (mge.EmailField, frp_fields.String),
-                              (mge.IntField, frp_fields.Integer),
-                              (mge.LongField, frp_fields.Integer),
-                              (mge.FloatField, frp_fields.Float),
-                              (mge.DecimalField, frp_fields.Float),
-                              (mge.BooleanField, frp_fields.Boolean),
-                              (mge.DateField, frp_fields.Date),
-                              (mge.DateTimeField, cls.default_datetimefield),
-                              (mge.ComplexDateTimeField, frp_fields.DateTime),
-                              (mge.ObjectIdField, frp_fields.String)
-                              # todo mongoengine 有一堆不容易获取的类型
-                              ])
+        FieldsMapping = field_registry.get_mapping('mongo', cls.default_datetimefield)
         if STRICT_CHECK and mongo_field not in FieldsMapping:
             raise Exception("复杂field对象必须自定义Field")
         fields.append(FieldsMapping.get(type(mongo_field), frp_fields.String))
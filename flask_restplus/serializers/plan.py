@@ -0,0 +1,123 @@
+import copy
+from collections import OrderedDict
+from flask_restplus.fields import Raw, Wildcard, MarshallingError, get_value
+from flask_restplus.marshalling import marshal
+
+"""
+    序列化计划：每个Serializer类只编译一次字段，得到有序的 (输出key, 取值函数, 格式化函数) 元组。
+    data 对实例列表逐条执行计划即可，无需每条数据都经过 marshal 重新遍历字段字典。
+    输出与 marshal(obj, fields, ordered=True, skip_none=skip_none) 保持一致。
+"""
+_plan_registry = {}
+
+
+def _attr_getter(attribute):
+    """与 flask_restplus.fields.get_value 取值规则一致：先尝试下标，再取属性"""
+    if callable(attribute):
+        return attribute
+    if '.' in attribute:
+        return lambda obj: get_value(attribute, obj)
+
+    def getter(obj):
+        if not isinstance(obj, str) and hasattr(obj, '__iter__'):
+            try:
+                return obj[attribute]
+            except (IndexError, TypeError, KeyError):
+                pass
+        return getattr(obj, attribute, None)
+    return getter
+
+
+def _identity(obj):
+    return obj
+
+
+def _raw_formatter(key, field):
+    """Raw.output 的展开版本，仅用于未重写 output 的字段"""
+    field_format = field.format
+    mask = field.mask
+
+    def formatter(value):
+        if value is None:
+            default = field._v('default')
+            return field_format(default) if default else default
+        try:
+            data = field_format(value)
+        except MarshallingError as e:
+            msg = 'Unable to marshal field "{0}" value "{1}": {2}'.format(key, value, str(e))
+            raise MarshallingError(msg)
+        return mask.apply(data) if mask else data
+    return formatter
+
+
+def compile_step(key, field, skip_none=False, hooked=False):
+    """
+        编译单个字段
+        Nested/List 等重写了 output 的字段及字典嵌套，仍交由其自身逻辑处理，保证输出一致
+        hooked 表示字段值由 get_<field> 计算，取值函数记为None，执行时从旁路表(row)读取
+    :return: (key, getter, formatter)
+    """
+    if isinstance(field, type):
+        field = field()
+    if hooked:
+        getter = None
+        if isinstance(field, dict):
+            return key, getter, lambda value: marshal(value, field, skip_none=skip_none, ordered=True)
+        if type(field).output is not Raw.output:
+            field = copy.copy(field)
+            field.attribute = None
+            return key, getter, lambda value: field.output(key, {key: value}, ordered=True)
+        return key, getter, _raw_formatter(key, field)
+    if isinstance(field, dict):
+        return key, _identity, lambda obj: marshal(obj, field, skip_none=skip_none, ordered=True)
+    if type(field).output is not Raw.output:
+        return key, _identity, lambda obj: field.output(key, obj, ordered=True)
+    attribute = key if field.attribute is None else field.attribute
+    return key, _attr_getter(attribute), _raw_formatter(key, field)
+
+
+def compile_plan(fields, skip_none=False, hooks=()):
+    """
+        含 Wildcard 字段时无法预先确定输出key，返回 None，由调用方退回 marshal
+    """
+    steps = []
+    for key, field in fields.items():
+        if isinstance(field, Wildcard) or (isinstance(field, type) and issubclass(field, Wildcard)):
+            return None
+        steps.append(compile_step(key, field, skip_none, key in hooks))
+    return tuple(steps)
+
+
+def get_plan(serializer_cls, fields, skip_none=False, hooks=(), variant=None):
+    """
+    :param variant: 同一序列化器的不同取值方式(如原始字典 'raw')各自编译
+    """
+    key = (serializer_cls, skip_none, variant)
+    if key not in _plan_registry:
+        _plan_registry[key] = compile_plan(fields, skip_none, hooks)
+    return _plan_registry[key]
+
+
+def clear_plans(serializer_cls=None):
+    for key in list(_plan_registry):
+        if serializer_cls is None or key[0] is serializer_cls:
+            del _plan_registry[key]
+
+
+_EMPTY_ROW = {}
+
+
+def run_plan(plan, obj, skip_none=False, row=None):
+    """
+    :param row: get_<field> 钩子计算出的 {field: value}
+    """
+    row = row or _EMPTY_ROW
+    if not skip_none:
+        return OrderedDict([(key, formatter(row.get(key) if getter is None else getter(obj)))
+                            for key, getter, formatter in plan])
+    out = OrderedDict()
+    for key, getter, formatter in plan:
+        value = formatter(row.get(key) if getter is None else getter(obj))
+        if value is not None and value != {}:
+            out[key] = value
+    return out
@@ -1,16 +1,28 @@
 import copy
 import six
 import logging
+from types import MappingProxyType
 from collections import OrderedDict
+from collections.abc import Mapping
 from flask_restplus.fields import Raw
 from flask_restplus.model import ModelBase
 from flask_restplus.marshalling import marshal
 from ...widgets.decorators import class_property
 from ...flex import current_flex
+from .plan import get_plan, run_plan
 logger = logging.getLogger(__name__)
 ALL_FIELDS = '__all__'
 _serializer_registry = {}
 
+
+def is_many(instance):
+    """列表、生成器、mongoengine QuerySet、peewee查询等可迭代对象视为多条；字符串、字典与单个文档/模型对象为单条"""
+    if isinstance(instance, list):
+        return True
+    if instance is None or isinstance(instance, (str, bytes, Mapping)) or hasattr(instance, '_meta'):
+        return False
+    return hasattr(instance, '__iter__')
+
 """
     marshal中以字典定义数据结构，以格式化对象得到所需数据。
     字典无法继承重写，无法自定义方法，故自行编写了Serializer完成该功能，简化代码。
@@ -56,70 +68,169 @@ class Serializer(ModelBase):
 
     def __init__(self, instance=None, **kwargs):
         """
-        :param instance: 待转化对象,支持字典
-        :param kwargs:
+        :param instance: 待转化对象,支持字典；列表或未求值的查询集等可迭代对象按多条处理
+        :param kwargs: _many_ 显式指定是否多条
         """
         self._instance_ = instance
         self.name = self.__class__.__module__ + '.' + self.__class__.__name__
         if '_many_' in kwargs:
             self.many = kwargs.pop('_many_')
         else:
-            self.many = isinstance(instance, list)
+            self.many = is_many(instance)
         self.skip_none = kwargs.pop('_skip_none_', False)
+        self._handled_ = False
+        self._computed_ = {}
+        self._objs_ = None
         _serializer_registry[self.__class__.__module__ + '.' + self.__class__.__name__] = self.__class__
 
-
     @classmethod
     def get_fields(cls):
-        return copy.deepcopy(cls._declared_fields)
+        return OrderedDict(cls._declared_fields)
 
     @class_property
     def fields(cls):
         """
         A dictionary of {field_name: field_instance}.OrderedDict
+        每个类只构建一次且只读，get_%s 的取值重定向记录在序列化计划中，不再改写field对象
         """
-        if not hasattr(cls, '_fields'):
-            cls._fields = OrderedDict([])
-            for key, value in cls.get_fields().items():
-                cls._fields[key] = value
-                if hasattr(cls, 'get_%s' % key):
-                    value.attribute = '__func__%s' % key
+        if '_fields' not in cls.__dict__:
+            cls._fields = MappingProxyType(OrderedDict(cls.get_fields()))
         return cls._fields
 
+    @class_property
+    def hook_fields(cls):
+        """定义了 get_%s 或 get_many_%s 方法的字段，每个类只计算一次"""
+        if '_hook_fields' not in cls.__dict__:
+            cls._hook_fields = tuple(key for key in cls.fields
+                                     if hasattr(cls, 'get_%s' % key) or hasattr(cls, 'get_many_%s' % key))
+        return cls._hook_fields
+
     def parse_data_item(self, obj):
-        for field in self.fields:
-            if hasattr(self, 'get_%s' % field):
-                func = getattr(self, 'get_%s' % field)
-                setattr(obj, '__func__%s' % field, func(obj, field))
+        """逐条调用 get_%s(obj, field)，结果写入以对象id为键的旁路表，不再写到对象上"""
+        row = self._computed_.setdefault(id(obj), {})
+        for field in self.hook_fields:
+            if field in row or not hasattr(self, 'get_%s' % field):
+                continue
+            row[field] = getattr(self, 'get_%s' % field)(obj, field)
+
+    def parse_data_batch(self, objs):
+        """
+            批量钩子：get_many_%s(objs) 一次返回整页数据的值(与objs顺序一致)，避免逐条查询数据库
+        """
+        for field in self.hook_fields:
+            if not hasattr(self, 'get_many_%s' % field):
+                continue
+            values = getattr(self, 'get_many_%s' % field)(objs)
+            for obj, value in zip(objs, values):
+                self._computed_.setdefault(id(obj), {})[field] = value
 
     def prepare_data(self):
         """parse_data_item进行数据准备，以免在marshal data时重复查询数据库"""
         pass
 
+    def compute_hooks(self, objs):
+        """计算一页数据的钩子字段，先批量钩子，再逐条钩子；没有钩子字段时跳过"""
+        if not self.hook_fields:
+            return
+        self.parse_data_batch(objs)
+        for i in objs:
+            self.parse_data_item(i)
+
     def handle_data(self):
+        objs = list(self._instance_) if self.many else [self._instance_]
+        self._objs_ = objs
+        self.compute_hooks(objs)
+
+    def ready_data(self):
+        """prepare_data/handle_data 每个实例只执行一次"""
+        if not self._handled_:
+            self.prepare_data()
+            self.handle_data()
+            self._handled_ = True
+
+    def get_plan(self, skip_none=None):
+        """序列化计划，每个类按skip_none各编译一次"""
+        skip_none = self.skip_none if skip_none is None else skip_none
+        return get_plan(self.__class__, self.fields, skip_none, self.hook_fields)
+
+    def serialize(self, skip_none=None):
+        """
+            按序列化计划输出数据，响应格式(Table/Response)中的data字段也由此生成
+        :param skip_none: 默认使用序列化器自身的skip_none
+        """
+        skip_none = self.skip_none if skip_none is None else skip_none
+        if self._instance_:
+            self.ready_data()
+        plan = self.get_plan(skip_none)
+        computed = self._computed_
         if not self.many:
-            self.parse_data_item(self._instance_)
-        else:
-            for i in self._instance_:
-                self.parse_data_item(i)
+            obj = self._instance_ or {}
+            if plan is None:
+                return marshal(obj, self._hooked_fields(), ordered=True, skip_none=skip_none)
+            return run_plan(plan, obj, skip_none, computed.get(id(obj)))
+        objs = self._objs_ if self._objs_ is not None else (self._instance_ or [])
+        if plan is None:
+            fields = self._hooked_fields()
+            return [marshal(item, fields, ordered=True, skip_none=skip_none) for item in objs]
+        return [run_plan(plan, item, skip_none, computed.get(id(item))) for item in objs]
+
+    def iter_data(self, chunk_size=500, skip_none=None):
+        """
+            流式输出：按块遍历游标，每块执行钩子后逐条输出，已输出的数据不在内存中保留
+            mongoengine QuerySet 以 no_cache 遍历，peewee 查询以 iterator 遍历
+        :param chunk_size: 每块条数，即 get_many_%s 一次处理的数据量
+        """
+        skip_none = self.skip_none if skip_none is None else skip_none
+        if not self.many:
+            if self._instance_:
+                yield self.serialize(skip_none)
+            return
+        instance = self._instance_ or []
+        if hasattr(instance, 'no_cache') and getattr(instance, '_result_cache', None) is None:
+            instance = instance.no_cache()
+        elif hasattr(instance, 'iterator'):
+            instance = instance.iterator()
+        self.prepare_data()
+        plan = self.get_plan(skip_none)
+        fields = self._hooked_fields() if plan is None else None
+        chunk = []
+        for obj in instance:
+            chunk.append(obj)
+            if len(chunk) >= chunk_size:
+                yield from self._serialize_chunk(chunk, plan, fields, skip_none)
+                chunk = []
+        if chunk:
+            yield from self._serialize_chunk(chunk, plan, fields, skip_none)
+
+    def _serialize_chunk(self, objs, plan, fields, skip_none):
+        self._computed_ = {}
+        self.compute_hooks(objs)
+        for obj in objs:
+            if plan is None:
+                yield marshal(obj, fields, ordered=True, skip_none=skip_none)
+            else:
+                yield run_plan(plan, obj, skip_none, self._computed_.get(id(obj)))
+        self._computed_ = {}
+
+    def _hooked_fields(self):
+        """无法编译计划时(含Wildcard)退回marshal，此时才复制字段并重定向到旁路表取值"""
+        fields = OrderedDict(self.fields)
+        for key in self.hook_fields:
+            fields[key] = copy.copy(fields[key]() if isinstance(fields[key], type) else fields[key])
+            fields[key].attribute = lambda obj, key=key: self._computed_.get(id(obj), {}).get(key)
+        return fields
 
     @property
     def data(self):
         if not self._instance_:
             return [] if self.many else {}
-        self.prepare_data()
-        self.handle_data()
-        if not self.many:
-            return marshal(self._instance_, self.fields, ordered=True, skip_none=self.skip_none)
-        else:
-            return [marshal(item, self.fields, ordered=True, skip_none=self.skip_none) for item in self._instance_]
+        return self.serialize()
 
     def fields_model(self):
         return self
 
     def table(self, **kwargs):
-        self.prepare_data()
-        self.handle_data()
+        self.ready_data()
         return self._format_table(
             _serializer_=self,
             **kwargs
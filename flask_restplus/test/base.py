@@ -0,0 +1,15 @@
+from flask import Flask
+from flask_restplus import Api
+from ...flex import current_flex
+
+"""
+    测试用的 flex 初始化：serializers/formats/resource 在导入时读取 current_api 与 current_flex 配置，须先于它们导入
+"""
+app = Flask(__name__)
+api = Api(app)
+current_flex.setdefault('apis', {'api': api})
+current_flex.setdefault('db_engine', 'mongo')
+if 'formats' not in current_flex:
+    from ..formats import BaseTable, BaseResponse, BaseListResponse, error_fields
+    current_flex.formats = {'Table': BaseTable, 'Response': BaseResponse, 'ListResponse': BaseListResponse,
+                            'error_fields': error_fields}
@@ -0,0 +1,74 @@
+import time
+import datetime
+import mongomock
+import mongoengine
+from .base import app
+from ..serializers import ModelSerializer
+
+"""
+    原始字典与Document两种序列化路径的基准：python -m <package>.flask_restplus.test.bench_raw
+"""
+
+
+class BenchSub(mongoengine.EmbeddedDocument):
+    name = mongoengine.StringField()
+    level = mongoengine.IntField(default=1)
+
+
+class BenchTag(mongoengine.EmbeddedDocument):
+    name = mongoengine.StringField()
+
+
+class BenchUser(mongoengine.Document):
+    meta = {'collection': 'bench_raw_user'}
+    name = mongoengine.StringField()
+    age = mongoengine.IntField()
+    active = mongoengine.BooleanField(default=True)
+    score = mongoengine.FloatField(default=lambda: 0.5)
+    tags = mongoengine.ListField(mongoengine.StringField())
+    subs = mongoengine.ListField(mongoengine.EmbeddedDocumentField(BenchSub))
+    labels = mongoengine.ListField(mongoengine.EmbeddedDocumentField(BenchTag))
+    note = mongoengine.StringField(default='n', null=True)
+    create_time = mongoengine.DateTimeField(default=datetime.datetime.now)
+
+
+class FlatUserSerializer(ModelSerializer):
+    """全部字段可直接从原始字典取值"""
+    class Meta:
+        model = BenchUser
+        fields = ['id', 'name', 'age', 'active', 'score', 'tags', 'labels', 'note']
+
+
+class NestedUserSerializer(ModelSerializer):
+    """subs 内层有默认值，需构建Document取值"""
+    class Meta:
+        model = BenchUser
+        fields = ['id', 'name', 'age', 'active', 'score', 'tags', 'subs', 'labels', 'note']
+
+
+def bench(n=10000, repeat=3):
+    mongoengine.connect('flex_bench', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+    BenchUser.drop_collection()
+    BenchUser._get_collection().insert_many([
+        {'name': 'u%s' % i, 'age': i, 'tags': ['a', 'b'], 'labels': [{'name': 'l'}]} if i % 2 else {'name': 'u%s' % i}
+        for i in range(n)])
+    rows = list(BenchUser.objects.as_pymongo())
+    results = {}
+    with app.test_request_context():
+        for serializer_cls in (FlatUserSerializer, NestedUserSerializer):
+            for name, make in (('document', lambda: serializer_cls([BenchUser._from_son(r) for r in rows])),
+                               ('raw', lambda: serializer_cls([dict(r) for r in rows], _raw_=True))):
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    make().data
+                    cost = time.perf_counter() - start
+                    best = cost if best is None else min(best, cost)
+                results['%s %s' % (serializer_cls.__name__, name)] = best
+    mongoengine.disconnect()
+    return results
+
+
+if __name__ == '__main__':
+    for name, seconds in bench().items():
+        print('%-30s %.4fs' % (name, seconds))
@@ -0,0 +1,53 @@
+import timeit
+from flask_restplus import fields
+from flask_restplus.marshalling import marshal
+from .base import app
+from ..serializers import Serializer
+from ..formats import BaseTable
+
+"""
+    序列化器构建与表格输出的微基准：python -m <package>.flask_restplus.test.bench_serializer
+"""
+
+
+class BenchSerializer(Serializer):
+    name = fields.String
+    count = fields.Integer
+    score = fields.Float
+    tags = fields.List(fields.String)
+
+
+def bench(number=10000, rows=100):
+    items = [{'name': 'n%s' % i, 'count': i, 'score': i / 3, 'tags': ['a', 'b'], 'actions': ['edit']}
+             for i in range(rows)]
+    table_fields = BaseTable.get_fields(BenchSerializer, add_action=True)
+    results = {
+        'construct': timeit.timeit(lambda: BenchSerializer(items), number=number),
+        'fields': timeit.timeit(lambda: BenchSerializer.fields, number=number),
+    }
+    with app.test_request_context():
+        results['table(%s rows)' % rows] = timeit.timeit(
+            lambda: marshal(BenchSerializer(items).table(message='', total=rows), table_fields),
+            number=number // 100)
+    return results
+
+
+def bench_plan(rows=10000, repeat=3):
+    """序列化计划与逐条 marshal 的对比，取多次中最快的一次"""
+    items = [{'name': 'n%s' % i, 'count': i, 'score': i / 3, 'tags': ['a', 'b']} for i in range(rows)]
+    results = {}
+    with app.test_request_context():
+        for skip_none in (False, True):
+            results['marshal(%s rows, skip_none=%s)' % (rows, skip_none)] = min(timeit.repeat(
+                lambda: [marshal(item, BenchSerializer.fields, ordered=True, skip_none=skip_none) for item in items],
+                number=1, repeat=repeat))
+            results['plan(%s rows, skip_none=%s)' % (rows, skip_none)] = min(timeit.repeat(
+                lambda: BenchSerializer(items, _skip_none_=skip_none).data, number=1, repeat=repeat))
+    return results
+
+
+if __name__ == '__main__':
+    for name, seconds in bench().items():
+        print('%-20s %.4fs' % (name, seconds))
+    for name, seconds in bench_plan().items():
+        print('%-40s %.4fs' % (name, seconds))
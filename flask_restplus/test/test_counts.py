@@ -0,0 +1,48 @@
+import unittest
+import mongomock
+import mongoengine
+from flask_restplus import fields
+from flask_restplus.marshalling import marshal
+from .base import app
+from ..serializers import Serializer
+from ..formats import BaseTable
+from ..counts import CappedCount, get_count_strategy
+
+
+class CountItem(mongoengine.Document):
+    meta = {'collection': 'count_item'}
+    n = mongoengine.IntField()
+
+
+class CountSerializer(Serializer):
+    n = fields.Integer
+
+
+class CappedCountTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        mongoengine.connect('flex_test', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+        CountItem.drop_collection()
+        CountItem.objects.insert([CountItem(n=i) for i in range(5)])
+
+    @classmethod
+    def tearDownClass(cls):
+        mongoengine.disconnect()
+
+    def test_cap(self):
+        self.assertEqual(CappedCount(cap=5).info(CountItem.objects), {'total': 5, 'total_capped': False})
+        self.assertEqual(CappedCount(cap=4).info(CountItem.objects), {'total': 4, 'total_capped': True})
+        self.assertEqual(CappedCount(cap=10).info(CountItem.objects(n__lt=2)), {'total': 2, 'total_capped': False})
+        self.assertEqual(get_count_strategy('exact').info(CountItem.objects), {'total': 5, 'total_capped': False})
+
+    def test_table_format(self):
+        info = CappedCount(cap=3).info(CountItem.objects)
+        table = CountSerializer(list(CountItem.objects[:3])).table(message='list', **info)
+        with app.test_request_context():
+            res = marshal(table, BaseTable.get_fields(CountSerializer, add_action=False))
+        self.assertEqual(res['total'], 3)
+        self.assertTrue(res['total_capped'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import mongoengine
+from flask_restplus import fields
+from .base import api
+from ..serializers import ModelSerializer
+from ..serializers.field_registry import field_registry
+
+
+class RegAddress(mongoengine.EmbeddedDocument):
+    city = mongoengine.StringField()
+
+
+class RegUser(mongoengine.Document):
+    meta = {'collection': 'reg_user'}
+    name = mongoengine.StringField()
+    age = mongoengine.IntField()
+    address = mongoengine.EmbeddedDocumentField(RegAddress)
+
+
+class RegUserSerializer(ModelSerializer):
+    class Meta:
+        model = RegUser
+        exclude = ['address']
+
+
+class RegUserStringSerializer(ModelSerializer):
+    class Meta:
+        model = RegUser
+        fields = ['name', 'age']
+
+    @classmethod
+    def get_base_fields_by_mge_field(cls, mongo_field):
+        return fields.String
+
+
+class FieldRegistryTest(unittest.TestCase):
+    def setUp(self):
+        field_registry.invalidate(RegUser)
+        field_registry.invalidate(RegAddress)
+        api.models.pop('EmbeddedDocument %s.%s' % (RegAddress.__module__, RegAddress.__name__), None)
+
+    def test_excluded_embedded_not_registered(self):
+        self.assertNotIn('address', RegUserSerializer.get_fields())
+        self.assertNotIn('EmbeddedDocument %s.%s' % (RegAddress.__module__, RegAddress.__name__), api.models)
+
+    def test_field_func_in_key(self):
+        self.assertIs(RegUserSerializer.get_fields()['age'], fields.Integer)
+        self.assertIs(RegUserStringSerializer.get_fields()['age'], fields.String)
+        self.assertIs(RegUserSerializer.get_model_fields(['age'])['age'], fields.Integer)
+
+    def test_requested_fields_only(self):
+        self.assertEqual(list(RegUserSerializer.get_model_fields(['age', 'name', 'missing'])), ['age', 'name'])
+        self.assertEqual(list(RegUserSerializer.get_model_fields()), list(RegUser._fields))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from flask_restplus import fields
+from flask_restplus.marshalling import marshal
+from .base import app
+from ..serializers import Serializer
+from ..formats import BaseTable
+
+
+class ItemSerializer(Serializer):
+    name = fields.String
+    count = fields.Integer
+
+
+class TableFormatTest(unittest.TestCase):
+    def test_add_action(self):
+        items = [{'name': 'a', 'count': 1, 'actions': ['edit']},
+                 {'name': 'b', 'count': 2, 'actions': ['edit', 'delete']}]
+        table = ItemSerializer(items).table(message='list', total=2)
+        with app.test_request_context():
+            res = marshal(table, BaseTable.get_fields(ItemSerializer, add_action=True), ordered=True)
+        self.assertEqual([dict(i) for i in res['data']],
+                         [{'name': 'a', 'count': 1, 'actions': ['edit']},
+                          {'name': 'b', 'count': 2, 'actions': ['edit', 'delete']}])
+        self.assertEqual(list(res['data'][0].keys()), ['name', 'count', 'actions'])
+
+    def test_without_action(self):
+        items = [{'name': 'a', 'count': 1, 'actions': ['edit']}]
+        table = ItemSerializer(items).table(message='list', total=1)
+        with app.test_request_context():
+            res = marshal(table, BaseTable.get_fields(ItemSerializer, add_action=False), ordered=True)
+        self.assertEqual([dict(i) for i in res['data']], [{'name': 'a', 'count': 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
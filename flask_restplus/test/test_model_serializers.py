@@ -0,0 +1,82 @@
+import unittest
+import datetime
+import mongomock
+import mongoengine
+from .base import app
+from ..serializers import ModelSerializer
+
+
+class Sub(mongoengine.EmbeddedDocument):
+    name = mongoengine.StringField()
+    level = mongoengine.IntField(default=1)
+
+
+class Tag(mongoengine.EmbeddedDocument):
+    name = mongoengine.StringField()
+
+
+class RawUser(mongoengine.Document):
+    meta = {'collection': 'raw_user'}
+    name = mongoengine.StringField()
+    age = mongoengine.IntField()
+    active = mongoengine.BooleanField(default=True)
+    score = mongoengine.FloatField(default=lambda: 0.5)
+    tags = mongoengine.ListField(mongoengine.StringField())
+    subs = mongoengine.ListField(mongoengine.EmbeddedDocumentField(Sub))
+    labels = mongoengine.ListField(mongoengine.EmbeddedDocumentField(Tag))
+    note = mongoengine.StringField(default='n', null=True)
+    create_time = mongoengine.DateTimeField(default=datetime.datetime.now)
+
+
+class RawUserSerializer(ModelSerializer):
+    class Meta:
+        model = RawUser
+        fields = ['id', 'name', 'age', 'active', 'score', 'tags', 'subs', 'labels', 'note']
+
+
+class RawSerializeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        mongoengine.connect('flex_test', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+        RawUser.drop_collection()
+        collection = RawUser._get_collection()
+        collection.insert_many([
+            {'name': 'empty'},
+            {'name': 'none', 'active': None, 'tags': None, 'note': None, 'score': None},
+            {'name': 'full', 'age': 3, 'active': False, 'score': 2.0, 'tags': ['a'], 'note': 'x',
+             'subs': [{'name': 's'}, {'name': 't', 'level': 2}], 'labels': [{'name': 'l'}]},
+        ])
+
+    @classmethod
+    def tearDownClass(cls):
+        mongoengine.disconnect()
+
+    def serialize_both(self, qs):
+        with app.test_request_context():
+            docs = RawUserSerializer(list(qs)).data
+            raws = RawUserSerializer(list(qs.as_pymongo()), _raw_=True).data
+        return [dict(i) for i in docs], [dict(i) for i in raws]
+
+    def test_missing_keys_parity(self):
+        docs, raws = self.serialize_both(RawUser.objects.order_by('name'))
+        self.assertEqual(raws, docs)
+        empty = [i for i in raws if i['name'] == 'empty'][0]
+        self.assertEqual((empty['active'], empty['score'], empty['tags'], empty['subs']), (True, 0.5, [], []))
+
+    def test_raw_fields(self):
+        fields, hydrate_keys = RawUserSerializer.get_raw_fields()
+        self.assertIn('subs', hydrate_keys)
+        self.assertNotIn('labels', hydrate_keys)
+        self.assertNotIn('active', hydrate_keys)
+        self.assertEqual(dict(RawUserSerializer.get_raw_defaults()).keys(), {'active', 'score', 'tags', 'labels'})
+
+    def test_iter_data_parity(self):
+        with app.test_request_context():
+            docs = list(RawUserSerializer(RawUser.objects.order_by('name')).iter_data(chunk_size=2))
+            raws = list(RawUserSerializer(RawUser.objects.order_by('name').as_pymongo(), _raw_=True)
+                        .iter_data(chunk_size=2))
+        self.assertEqual([dict(i) for i in raws], [dict(i) for i in docs])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import copy
+import unittest
+from collections import OrderedDict
+from flask_restplus import fields
+from flask_restplus.marshalling import marshal
+from .base import app, api
+from ..serializers import Serializer
+
+address_model = api.model('PlanAddress', OrderedDict([
+    ('city', fields.String),
+    ('zip', fields.String(default='000')),
+]))
+
+
+class PlanSerializer(Serializer):
+    name = fields.String
+    count = fields.Integer(default=0)
+    score = fields.Float
+    active = fields.Boolean
+    city = fields.String(attribute='address.city')
+    address = fields.Nested(address_model, allow_null=True)
+    addresses = fields.List(fields.Nested(address_model))
+    tags = fields.List(fields.String)
+    label = fields.String
+    size = fields.Integer
+
+    def get_label(self, obj, field):
+        name = obj.get('name') if isinstance(obj, dict) else obj.name
+        return name.upper() if name else None
+
+    def get_size(self, obj, field):
+        tags = obj.get('tags') if isinstance(obj, dict) else obj.tags
+        return len(tags) if tags else None
+
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def make_rows():
+    full = {'name': 'a', 'count': 3, 'score': 1.5, 'active': True, 'address': {'city': 'c', 'zip': '1'},
+            'addresses': [{'city': 'x'}, {'city': 'y', 'zip': None}], 'tags': ['t1', 't2']}
+    sparse = {'name': None, 'count': None, 'score': None, 'active': False, 'address': None,
+              'addresses': [], 'tags': None}
+    partial = {'name': 'b', 'address': {'city': None}}
+    rows = [full, sparse, partial]
+    return rows + [Obj(**dict({key: None for key in full}, **row)) for row in rows]
+
+
+class PlanMarshalTest(unittest.TestCase):
+    """序列化计划的输出须与 marshal(obj, fields, ordered=True, skip_none=...) 完全一致"""
+
+    def reference(self, serializer, obj, skip_none):
+        ref_fields = OrderedDict()
+        for key, field in PlanSerializer.fields.items():
+            field = copy.copy(field() if isinstance(field, type) else field)
+            if key in PlanSerializer.hook_fields:
+                field.attribute = lambda o, key=key: getattr(serializer, 'get_%s' % key)(o, key)
+            ref_fields[key] = field
+        return marshal(obj, ref_fields, ordered=True, skip_none=skip_none)
+
+    def test_many(self):
+        rows = make_rows()
+        with app.test_request_context():
+            for skip_none in (False, True):
+                serializer = PlanSerializer(rows, _skip_none_=skip_none)
+                data = serializer.data
+                self.assertEqual(len(data), len(rows))
+                for row, obj in zip(data, rows):
+                    expected = self.reference(serializer, obj, skip_none)
+                    self.assertEqual(row, expected)
+                    self.assertEqual(list(row), list(expected))
+
+    def test_single(self):
+        with app.test_request_context():
+            for obj in make_rows():
+                for skip_none in (False, True):
+                    serializer = PlanSerializer(obj, _skip_none_=skip_none)
+                    self.assertEqual(serializer.data, self.reference(serializer, obj, skip_none))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import json
+import base64
+import unittest
+from datetime import date, datetime, timezone, timedelta
+from bson import ObjectId
+from werkzeug.exceptions import BadRequest
+from . import base
+from ..resource import encode_cursor, decode_cursor
+
+
+class CursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        values = [datetime(2020, 1, 2, 3, 4, 5, 123456),
+                  datetime(2020, 1, 2, 3, 4, 5, 654321, tzinfo=timezone(timedelta(hours=8))),
+                  date(2020, 1, 2), ObjectId(), 'name', 3, None]
+        self.assertEqual(decode_cursor(encode_cursor(values)), values)
+
+    def test_invalid(self):
+        self.assertRaises(BadRequest, decode_cursor, 'not-a-cursor')
+
+    def test_reject_operators(self):
+        def raw_cursor(values):
+            return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+        for values in ([{'$ne': None}], [1, {'$gt': ''}], [[1, 2]], [{'$where': 'sleep(1000)'}], {'$ne': 1}, 'abc'):
+            with self.assertRaises(BadRequest) as ctx:
+                decode_cursor(raw_cursor(values))
+            self.assertEqual(ctx.exception.code, 400)
+        self.assertEqual(decode_cursor(raw_cursor([{'$oid': '5f0000000000000000000000'}, 1.5, True])),
+                         [ObjectId('5f0000000000000000000000'), 1.5, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
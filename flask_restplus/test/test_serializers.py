@@ -0,0 +1,114 @@
+import copy
+import json
+import unittest
+import mongomock
+import mongoengine
+from flask_restplus import fields
+from flask_restplus.marshalling import marshal
+from .base import app
+from ..serializers import Serializer
+from ..formats import BaseTable, BaseResponse
+from ...webbase.response import StreamTableResponse
+
+
+class Item(mongoengine.Document):
+    meta = {'collection': 'stream_item'}
+    name = mongoengine.StringField()
+    count = mongoengine.IntField()
+
+
+class ItemSerializer(Serializer):
+    name = fields.String
+    count = fields.Integer
+
+
+class SerializerManyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        mongoengine.connect('flex_test', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+        Item.drop_collection()
+        Item.objects.insert([Item(name='n%s' % i, count=i) for i in range(5)])
+
+    @classmethod
+    def tearDownClass(cls):
+        mongoengine.disconnect()
+
+    def test_many_detection(self):
+        self.assertTrue(ItemSerializer([]).many)
+        self.assertTrue(ItemSerializer(Item.objects).many)
+        self.assertTrue(ItemSerializer(i for i in []).many)
+        self.assertFalse(ItemSerializer({'name': 'a'}).many)
+        self.assertFalse(ItemSerializer(Item.objects.first()).many)
+        self.assertFalse(ItemSerializer('abc').many)
+        self.assertFalse(ItemSerializer(Item.objects, _many_=False).many)
+
+    def test_stream_queryset(self):
+        qs = Item.objects.order_by('count')
+        with app.test_request_context():
+            response = StreamTableResponse(ItemSerializer(qs), total=5, page_size=-1, chunk_size=2)
+            body = json.loads(''.join(response.response))
+        self.assertIsNone(qs._result_cache)
+        self.assertEqual(body['data'], [{'name': 'n%s' % i, 'count': i} for i in range(5)])
+        self.assertEqual(body['total'], 5)
+
+
+class BatchHookSerializer(Serializer):
+    name = fields.String
+    owner = fields.String
+    upper = fields.String
+
+    def __init__(self, *args, **kwargs):
+        super(BatchHookSerializer, self).__init__(*args, **kwargs)
+        self.batches = []
+
+    def get_many_owner(self, objs):
+        self.batches.append([obj['name'] for obj in objs])
+        return ['owner of %s' % obj['name'] for obj in objs]
+
+    def get_upper(self, obj, field):
+        return obj['name'].upper()
+
+
+class BatchHookTest(unittest.TestCase):
+    def setUp(self):
+        # 名称相同的两条数据，旁路表按对象id而非值区分
+        self.rows = [{'name': 'b'}, {'name': 'a'}, {'name': 'c'}, {'name': 'a'}]
+        self.origin = copy.deepcopy(self.rows)
+
+    def expected(self, row):
+        return {'name': row['name'], 'owner': 'owner of %s' % row['name'], 'upper': row['name'].upper()}
+
+    def test_data(self):
+        serializer = BatchHookSerializer(self.rows)
+        data = serializer.data
+        self.assertEqual(data, [self.expected(row) for row in self.origin])
+        self.assertEqual(serializer.data, data)
+        self.assertEqual(serializer.batches, [['b', 'a', 'c', 'a']])
+        self.assertEqual(self.rows, self.origin)
+
+    def test_table(self):
+        serializer = BatchHookSerializer(self.rows)
+        with app.test_request_context():
+            body = marshal(serializer.table(message='', total=4), BaseTable.get_fields(BatchHookSerializer))
+        self.assertEqual(body['data'], [self.expected(row) for row in self.origin])
+        self.assertEqual(len(serializer.batches), 1)
+        self.assertEqual(self.rows, self.origin)
+
+    def test_item(self):
+        serializer = BatchHookSerializer(self.rows[1])
+        with app.test_request_context():
+            body = marshal(serializer.item(), BaseResponse.get_fields(BatchHookSerializer))
+        self.assertEqual(body['data'], self.expected(self.origin[1]))
+        self.assertEqual(serializer.batches, [['a']])
+        self.assertEqual(self.rows, self.origin)
+
+    def test_stream_one_batch_per_chunk(self):
+        serializer = BatchHookSerializer(iter(self.rows))
+        data = list(serializer.iter_data(chunk_size=3))
+        self.assertEqual(data, [self.expected(row) for row in self.origin])
+        self.assertEqual(serializer.batches, [['b', 'a', 'c'], ['a']])
+        self.assertEqual(serializer._computed_, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
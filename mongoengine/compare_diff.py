@@ -1,4 +1,5 @@
-import difflib
+import re
+import time
 
 
 class CompareTwoDict:
@@ -7,9 +8,9 @@ class CompareTwoDict:
         认为数据符合mongeengine Document的定义，即不发生类型变更（变None除外)
         只比较基础差异，业务如果存在id对象的差异等情况，应当另行开发解决。
     """
-    RESULTS = []
-
-    def __init__(self, dict1, dict2, path='', mask=[], root_result_keys=[]):
+    def __init__(self, dict1, dict2, path='', mask=None, root_result_keys=None):
+        if root_result_keys is None:
+            root_result_keys = []
         self.dict1 = dict1
         self.dict2 = dict2
         if dict1 and dict2 and type(dict1) != type(dict2):
@@ -143,54 +144,117 @@ def get_attr(dic, path):
     return easy_str(v) if v else ''
 
 
-def diff_str(s1, s2):
-    res = difflib.ndiff(s1, s2)
-    results = []
-    last_sign = None
-    for r in res:
-        if r.startswith('+ '):
-            now_sign = 'strong'
-            item = r.replace('+ ', '', 1)
-            if last_sign == now_sign:
-                results.append(item)
-            elif last_sign == 'em':
-                s = '</%s>' % last_sign
-                if now_sign == 'strong':
-                    s += '<strong>'
-                s += item
-                results.append(s)
-            else:
-                results.append('<strong>' + item)
-            last_sign = now_sign
-        elif r.startswith('- '):
-            now_sign = 'em'
-            item = r.replace('- ', '', 1)
-            if last_sign == now_sign:
-                results.append(item)
-            elif last_sign == 'strong':
-                s = '</%s>' % last_sign
-                if now_sign == 'em':
-                    s += '<em>'
-                s += item
-                results.append(s)
-            else:
-                results.append('<em>' + item)
-            last_sign = now_sign
-        elif r.startswith(' '):
-            item = r.replace('  ', '', 1)
-            if last_sign == "strong":
-                results.append("</strong>")
-            elif last_sign == "em":
-                results.append("</em>")
-            results.append(item)
-            last_sign = None
+# diff_str 的计算预算：编辑距离上限与耗时上限(秒)，超出后整体标记为替换
+DIFF_MAX_EDITS = 1000
+DIFF_TIMEOUT = 0.1
+# 按两段文本总长度选择比较粒度：不超过 CHAR_DIFF_LIMIT 按字符，不超过 WORD_DIFF_LIMIT 按词，更长按行(无换行时仍按词)
+CHAR_DIFF_LIMIT = 2000
+WORD_DIFF_LIMIT = 20000
+_WORD_RE = re.compile(r'\w+|\s+|[^\w\s]')
+
+
+def tokenize(s1, s2):
+    size = len(s1) + len(s2)
+    if size <= CHAR_DIFF_LIMIT:
+        return list(s1), list(s2)
+    if size <= WORD_DIFF_LIMIT or ('\n' not in s1 and '\n' not in s2):
+        return _WORD_RE.findall(s1), _WORD_RE.findall(s2)
+    return s1.splitlines(True), s2.splitlines(True)
+
+
+def _backtrack(trace, a, b):
+    x, y = len(a), len(b)
+    ops = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
         else:
-            raise Exception('difflib error')
-    if last_sign:
-        results.append('</%s>' % last_sign)
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            ops.append((' ', a[x - 1]))
+            x, y = x - 1, y - 1
+        if d > 0:
+            ops.append(('+', b[y - 1]) if x == prev_x else ('-', a[x - 1]))
+        x, y = prev_x, prev_y
+    ops.reverse()
+    return ops
+
+
+def myers_diff(a, b, max_edits=None, deadline=None):
+    """
+        Myers O(ND) 差异算法
+    :return: [(' '|'-'|'+', token)]，编辑距离超过 max_edits 或超过 deadline(time.time()) 时返回 None
+    """
+    n, m = len(a), len(b)
+    max_d = n + m if max_edits is None else min(max_edits, n + m)
+    v = {1: 0}
+    trace = []
+    for d in range(max_d + 1):
+        if deadline is not None and time.time() > deadline:
+            return None
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x, y = x + 1, y + 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, a, b)
+    return None
+
+
+def render_diff(ops):
+    """删除的内容用 <em> 标记，新增的内容用 <strong> 标记"""
+    results = []
+    last_tag = None
+    for sign, token in ops:
+        tag = 'strong' if sign == '+' else 'em' if sign == '-' else None
+        if tag != last_tag:
+            if last_tag:
+                results.append('</%s>' % last_tag)
+            if tag:
+                results.append('<%s>' % tag)
+            last_tag = tag
+        results.append(token)
+    if last_tag:
+        results.append('</%s>' % last_tag)
     return ''.join(results)
 
 
+def diff_str(s1, s2, max_edits=None, timeout=None):
+    """
+        字符串差异标记，长文本按词或行比较；超出计算预算时，去掉首尾相同部分后整体标记为替换
+    :param max_edits: 编辑距离上限，默认 DIFF_MAX_EDITS
+    :param timeout: 耗时上限(秒)，默认 DIFF_TIMEOUT
+    """
+    if s1 == s2:
+        return s1
+    a, b = tokenize(s1, s2)
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-end - 1] == b[-end - 1]:
+        end += 1
+    a_mid, b_mid = a[start:len(a) - end], b[start:len(b) - end]
+    deadline = time.time() + (DIFF_TIMEOUT if timeout is None else timeout)
+    ops = myers_diff(a_mid, b_mid, DIFF_MAX_EDITS if max_edits is None else max_edits, deadline)
+    if ops is None:
+        ops = [('-', ''.join(a_mid)), ('+', ''.join(b_mid))]
+        ops = [op for op in ops if op[1]]
+    head = [(' ', ''.join(a[:start]))] if start else []
+    tail = [(' ', ''.join(a[len(a) - end:]))] if end else []
+    return render_diff(head + ops + tail)
+
+
 def mask_contain(index, mask):
     for key in mask:
         if key == index or index.startswith(key + '.'):
@@ -198,13 +262,153 @@ def mask_contain(index, mask):
     return False
 
 
-def get_diff(dic1, dic2, mask=[]):
-    """该方法使用到difflib.ndiff 测试在极差情况下，响应时间可能较长，该方法不应该再在for循环中使用，以控制时间"""
-    root_results = []
-    cmp = CompareTwoDict(dic1, dic2, mask=mask, root_result_keys=root_results)
-    cmp.main()
+def _masked(path, mask):
+    for m in mask:
+        if len(path) >= len(m) and all(str(p) == k for p, k in zip(path, m)):
+            return True
+    return False
+
+
+def _match_by_id(l1, l2):
+    """数组元素都是带 _id 的字典时按 _id 配对，返回 [(位置, 旧元素, 新元素)]，否则返回 None"""
+    if not all(isinstance(i, dict) and '_id' in i for i in l1) or \
+            not all(isinstance(i, dict) and '_id' in i for i in l2):
+        return None
+    old = {i['_id']: i for i in l1}
+    pairs = [(index, old.pop(i['_id'], None), i) for index, i in enumerate(l2)]
+    removed = [i for i in l1 if i['_id'] in old]
+    pairs.extend((len(l2) + index, i, None) for index, i in enumerate(removed))
+    return pairs
+
+
+def iter_diff(v1, v2, mask=None, path=()):
+    """
+        一次遍历比较两份数据，逐个产出差异 (路径元组, 旧值, 新值)
+        字典按key深入比较，一侧缺失视为None；数组元素都带 _id 时按 _id 配对(路径用新数组中的位置，被删除的元素依次排在新数组之后)，否则按位置比较
+        字典与None比较时(新增或删除整个字典)只展开一层key，值为整个子项，与原 CompareTwoDict 一致
+        非容器的值以 != 判断，1 与 1.0、True 与 1 视为相同
+    :param mask: 忽略的路径，如 ['update_time', 'a.b']
+    """
+    if mask and not isinstance(mask[0], tuple):
+        mask = [tuple(m.split('.')) for m in mask]
+    if mask and _masked(path, mask):
+        return
+    if isinstance(v1, dict) or isinstance(v2, dict):
+        if isinstance(v1, dict) and isinstance(v2, dict):
+            for key in v1:
+                yield from iter_diff(v1[key], v2.get(key), mask, path + (key,))
+            for key in v2:
+                if key not in v1:
+                    yield from iter_diff(None, v2[key], mask, path + (key,))
+            return
+        if v1 is None or v2 is None:
+            for key, value in (v1 or v2).items():
+                key_path = path + (key,)
+                if not (mask and _masked(key_path, mask)):
+                    yield (key_path, value, None) if v2 is None else (key_path, None, value)
+            return
+    elif isinstance(v1, list) or isinstance(v2, list):
+        if (v1 is None or isinstance(v1, list)) and (v2 is None or isinstance(v2, list)):
+            l1, l2 = v1 or [], v2 or []
+            pairs = _match_by_id(l1, l2) if (l1 and l2) else None
+            if pairs is None:
+                pairs = [(i, l1[i] if i < len(l1) else None, l2[i] if i < len(l2) else None)
+                         for i in range(max(len(l1), len(l2)))]
+            for index, _v1, _v2 in pairs:
+                yield from iter_diff(_v1, _v2, mask, path + (index,))
+            return
+    if v1 != v2:
+        yield path, v1, v2
+
+
+def _display(v):
+    """与 get_attr 的取值展示一致"""
+    return easy_str(v) if v else ''
+
+
+def get_diff(dic1, dic2, mask=None, keys=None):
+    """
+        {点分路径: diff_str 标记}，基于 iter_diff 的结果
+        每个差异的 diff_str 计算有时间与编辑距离预算(DIFF_TIMEOUT/DIFF_MAX_EDITS)
+    :param keys: 只比较这些顶层key（已知其余key相同时使用，如 patch_root_keys 的结果）
+    """
+    if keys is None:
+        diffs = iter_diff(dic1, dic2, mask)
+    else:
+        d1, d2 = dic1 or {}, dic2 or {}
+        keys = [k for k in d1 if k in keys] + [k for k in d2 if k in keys and k not in d1]
+        diffs = (item for k in keys for item in iter_diff(d1.get(k), d2.get(k), mask, (k,)))
     res = {}
-    for i in root_results:
-        if not mask_contain(i, mask):
-            res[i] = diff_str(get_attr(dic1, i), get_attr(dic2, i))
+    for path, v1, v2 in diffs:
+        res['.'.join(str(p) for p in path)] = diff_str(_display(v1), _display(v2))
     return res
+
+
+def _escape_pointer(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape_pointer(key):
+    return key.replace('~1', '/').replace('~0', '~')
+
+
+def get_patch(old, new, path=''):
+    """
+        计算 old -> new 的 JSON-patch(RFC 6902) 操作列表，用于历史记录的差异存储
+        字典逐key比较；等长数组逐项比较，长度变化的数组整体替换；类型不同或值不同的整体替换
+    :return: [{'op': 'add'|'remove'|'replace', 'path': '/a/0/b', 'value': v}]
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = [{'op': 'remove', 'path': path + '/' + _escape_pointer(k)} for k in old if k not in new]
+        for k, v in new.items():
+            if k not in old:
+                ops.append({'op': 'add', 'path': path + '/' + _escape_pointer(k), 'value': v})
+            else:
+                ops.extend(get_patch(old[k], v, path + '/' + _escape_pointer(k)))
+        return ops
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        ops = []
+        for i, (v1, v2) in enumerate(zip(old, new)):
+            ops.extend(get_patch(v1, v2, '%s/%s' % (path, i)))
+        return ops
+    if type(old) is not type(new) or old != new:
+        return [{'op': 'replace', 'path': path, 'value': new}]
+    return []
+
+
+def plain_copy(value):
+    """复制字典/数组层级(含 mongoengine 的 BaseDict/BaseList)为普通 dict/list，其它值原样引用"""
+    if isinstance(value, dict):
+        return {k: plain_copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [plain_copy(v) for v in value]
+    return value
+
+
+def patch_root_keys(patch):
+    """patch 涉及的顶层key，整体替换时返回 None"""
+    keys = set()
+    for op in patch:
+        if not op['path']:
+            return None
+        keys.add(_unescape_pointer(op['path'].split('/')[1]))
+    return keys
+
+
+def apply_patch(doc, patch):
+    """按 get_patch 的结果还原，返回新对象，不修改 doc"""
+    doc = plain_copy(doc)
+    for op in patch:
+        if not op['path']:
+            doc = plain_copy(op['value'])
+            continue
+        keys = [_unescape_pointer(k) for k in op['path'].split('/')[1:]]
+        target = doc
+        for k in keys[:-1]:
+            target = target[int(k)] if isinstance(target, list) else target[k]
+        last = int(keys[-1]) if isinstance(target, list) else keys[-1]
+        if op['op'] == 'remove':
+            del target[last]
+        else:
+            target[last] = plain_copy(op['value'])
+    return doc
@@ -1,14 +1,23 @@
 import uuid
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from datetime import datetime
 from copy import deepcopy, copy
+from concurrent.futures import ThreadPoolExecutor
 from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from mongoengine import fields, EmbeddedDocumentField, EmbeddedDocumentListField, ReferenceField, DateTimeField, DateField, ListField, Document, StringField
 from mongoengine.base.metaclasses import DocumentMetaclass, TopLevelDocumentMetaclass
 from mongoengine.queryset import queryset_manager
+from mongoengine.errors import ValidationError
 try:
     from dateutil import parser
 except:
     from dateparser import parser
 from ..widgets.decorators import class_property
+from .identity_map import get_by_pk, get_many_by_pk, get_cached, get_manager, remember, _to_pk
 
 
 def get_field_cls(cls, key, silent=True):
@@ -46,12 +55,126 @@ def copy_cls(cls, base_cls=None, class_name=None, **kwargs):
     if not base_cls:
         base_cls = cls.__bases__[0]
     attrs = dict(cls.__dict__)
+    # 按类缓存的编译结果不随复制继承，由新类重新生成
+    for key in ('_converters_', '_reference_targets_'):
+        attrs.pop(key, None)
     attrs.update(kwargs)
     return DocumentMetaclass.__new__(mcs=DocumentMetaclass,
                                      name=class_name or '%s%s' % (cls.__name__, uuid.uuid1()),
                                      bases=(base_cls,), attrs=attrs)
 
 
+def parse_datetime(value):
+    """ISO 8601 字符串走 datetime.fromisoformat，其它格式交给 dateutil"""
+    try:
+        return datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        return parser.parse(value)
+
+
+def _identity(value):
+    return value
+
+
+def compile_converter(field):
+    """
+        单个字段的值转换函数，按 field.__class__ 精确分派(不含子类)，规则与原 update_document 一致
+    """
+    field_cls = field.__class__
+    if field_cls in (fields.ListField, fields.SortedListField):
+        item_converter = compile_converter(field.field)
+
+        def convert_list(value):
+            if value is None:
+                return None
+            return [item_converter(item) for item in value]
+        return convert_list
+    if field_cls is DateTimeField:
+        return lambda value: parse_datetime(value) if type(value) is str else value
+    if field_cls is DateField:
+        return lambda value: parse_datetime(value).date() if type(value) is str else value
+    if field_cls in (fields.EmbeddedDocumentField, fields.ReferenceField,
+                     fields.GenericEmbeddedDocumentField, fields.GenericReferenceField):
+        is_reference = field_cls is fields.ReferenceField
+
+        def convert_document(value):
+            if is_reference and type(value) in (ObjectId, str):
+                return get_by_pk(field.document_type, value)
+            document_type = field.document_type
+            if hasattr(document_type, 'create_with') and document_type._restruct_:
+                return document_type.create_with(value)
+            return document_type(**value)
+        return convert_document
+    return _identity
+
+
+def get_converters(document_cls):
+    """
+        文档类的转换表 {field_name: converter}，每个类只编译一次，供 update_document 使用
+    """
+    if '_converters_' in document_cls.__dict__:
+        return document_cls._converters_
+    converters = {}
+    for name, field in document_cls._fields.items():
+        converter = compile_converter(field)
+        if isinstance(field, (EmbeddedDocumentField, ReferenceField, ListField, EmbeddedDocumentListField)):
+            converter = (lambda _convert: lambda value: None if value is None else _convert(value))(converter)
+        converters[name] = converter
+    document_cls._converters_ = converters
+    return converters
+
+
+def _collect_dict_delta(current, data_dict, merged, prefix, sets):
+    """
+    :param current: 当前值的 to_mongo 结果
+    :param merged: 合并后新值的 to_mongo 结果，写入的值取自此处
+    """
+    for key, value in data_dict.items():
+        path = prefix + key
+        new_value = merged[key]
+        if isinstance(value, dict) and isinstance(current.get(key), dict) and isinstance(new_value, dict):
+            _collect_dict_delta(current[key], value, new_value, path + '.', sets)
+        elif key not in current or current[key] != new_value:
+            sets[path] = new_value
+
+
+def _collect_delta(document, data_dict, prefix, sets, unsets, applies):
+    """
+        计算 data_dict 相对 document 的最小修改，语义同 update_with：
+        嵌入文档与 DictField 逐层合并，其它值整体替换，值以 to_mongo 结果比较
+        有变化的字段先经 field.validate 校验，校验失败时抛出异常，不产生任何写入
+    :param applies: [(doc, key, value)] 写库后需同步到对象的修改
+    """
+    converters = get_converters(document.__class__)
+    for key, value in data_dict.items():
+        try:
+            field = document._fields[key]
+            path = prefix + field.db_field
+            current = document._data.get(key)
+            if value is None:
+                if current is not None:
+                    if field.required:
+                        raise ValidationError('Field is required')
+                    unsets[path] = 1
+                    applies.append((document, key, None))
+            elif isinstance(value, dict) and current is not None and isinstance(field, EmbeddedDocumentField):
+                _collect_delta(current, value, path + '.', sets, unsets, applies)
+            elif isinstance(value, dict) and isinstance(current, dict) and isinstance(field, fields.DictField):
+                merged = rec_merge(deepcopy(current), value)
+                field.validate(merged)
+                _collect_dict_delta(field.to_mongo(current), value, field.to_mongo(merged), path + '.', sets)
+                applies.append((document, key, merged))
+            else:
+                new_value = converters[key](value)
+                mongo_value = field.to_mongo(new_value)
+                if current is None or field.to_mongo(current) != mongo_value:
+                    field.validate(new_value)
+                    sets[path] = mongo_value
+                    applies.append((document, key, new_value))
+        except Exception as e:
+            raise Exception('err field %s - value %s | %s' % (key, str(value), str(e)))
+
+
 def rec_merge(d1, d2):
     """
     递归合并字典
@@ -70,10 +193,90 @@ def rec_merge(d1, d2):
     return d1
 
 
+_son_cache_state = threading.local()
+
+
+@contextmanager
+def son_cache():
+    """
+        在此范围内 to_mongo 的结果按文档实例缓存(区分 use_db_field)，_mark_as_changed 时失效，
+        嵌入文档(DocumentMixin)的修改经 _instance 逐级使外层文档的缓存失效。
+        未继承 DocumentMixin 的嵌入文档内部修改无法感知，范围内 save 前应调用 reset_son_cache
+        (save 中 clean() 可能修改嵌入字段)。最外层范围结束时清除范围内产生的全部缓存。
+    """
+    depth = getattr(_son_cache_state, 'depth', 0)
+    if not depth:
+        _son_cache_state.docs = []
+    _son_cache_state.depth = depth + 1
+    try:
+        yield
+    finally:
+        _son_cache_state.depth -= 1
+        if not _son_cache_state.depth:
+            reset_son_cache()
+
+
+def reset_son_cache():
+    """清除当前范围内已缓存的全部 to_mongo 结果"""
+    for doc in getattr(_son_cache_state, 'docs', ()):
+        doc.__dict__.pop('_son_cache_', None)
+    _son_cache_state.docs = []
+
+
+def _memoize_to_mongo(to_mongo):
+    @wraps(to_mongo)
+    def wrapper(self, use_db_field=True, fields=None):
+        if fields or not getattr(_son_cache_state, 'depth', 0):
+            return to_mongo(self, use_db_field, fields)
+        cache = self.__dict__.get('_son_cache_')
+        if cache is None:
+            cache = self.__dict__['_son_cache_'] = {}
+            _son_cache_state.docs.append(self)
+        if use_db_field not in cache:
+            cache[use_db_field] = to_mongo(self, use_db_field, fields)
+        return cache[use_db_field]
+    wrapper._son_cache_ = True
+    return wrapper
+
+
+def _clear_son_cache(method):
+    """
+        字段赋值(实例初始化完成后)、列表/字典的修改都会调用 _mark_as_changed；
+        加载文档时不调用，不影响查询的性能
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        doc = self
+        while doc is not None:
+            try:
+                getattr(doc, '__dict__', {}).pop('_son_cache_', None)
+                doc = getattr(doc, '_instance', None)
+            except ReferenceError:
+                break
+        return method(self, *args, **kwargs)
+    wrapper._son_cache_ = True
+    return wrapper
+
+
 class DocumentMixin:
     _restruct_ = False
     base_ignore_fields = []
 
+    def __init_subclass__(cls, **kwargs):
+        """
+            常见写法为 class A(Document, DocumentMixin)，Mixin 中重写的方法会被 Document 覆盖，
+            因此在子类上直接包装 to_mongo 缓存及其失效方法
+        """
+        super().__init_subclass__(**kwargs)
+        for name, decorator in (('to_mongo', _memoize_to_mongo),
+                                ('_mark_as_changed', _clear_son_cache)):
+            method = getattr(cls, name, None)
+            if method is not None and not getattr(method, '_son_cache_', False):
+                setattr(cls, name, decorator(method))
+
+    def clear_son_cache(self):
+        self.__dict__.pop('_son_cache_', None)
+
     @queryset_manager
     def ori_objects(doc_cls, queryset):
         """原始"""
@@ -88,7 +291,7 @@ class DocumentMixin:
 
     @property
     def db_dict(self):
-        """mongo取出的原数据"""
+        """mongo取出的原数据，返回副本，可在 son_cache() 范围内复用 to_mongo 结果"""
         return self.to_mongo().to_dict()
 
     def to_dict(self, need_id=False):
@@ -143,15 +346,19 @@ class DocumentMixin:
         DocumentMixin.update_document(s, data_dict)
         return s
 
-    def update_with(self, data_dict, ignore_fields=None):
+    def update_with(self, data_dict, ignore_fields=None, atomic=False):
         """
             利用字典内容更新对象。屏蔽掉若干字段。
             如果是字典，进行merge动作；其它的，如数组，进行替换动作
         :param data_dict:
         :param ignore_fields:
-        :return:
+        :param atomic: 直接写库：按输入字典与当前对象计算最小的 $set/$unset(db_field 点路径)，一次 update_one 写入并同步到对象，
+                       不再整体 to_dict 合并。对象须已保存
+        :return: atomic 时返回执行的 update 语句，无变化时为 {}
         """
         ignore_fields = ignore_fields or self.base_ignore_fields
+        if atomic:
+            return self._atomic_update_with({i: data_dict[i] for i in data_dict if i not in ignore_fields})
         res_data = self.to_dict()
         res_data = {key: res_data[key] for key in res_data if key in data_dict}
         for i in data_dict:
@@ -161,52 +368,122 @@ class DocumentMixin:
         # data_dict = {i: data_dict[i] for i in data_dict if i not in ignore_fields}
         # DocumentMixin.update_document(self, data_dict)
 
+    def _atomic_update_with(self, data_dict):
+        if self.pk is None:
+            raise Exception('atomic update_with 只能用于已保存的文档')
+        sets, unsets, applies = {}, {}, []
+        # 先完成全部字段的计算与校验，任一字段不合法时不写库
+        _collect_delta(self, data_dict, '', sets, unsets, applies)
+        update = {}
+        if sets:
+            update['$set'] = sets
+        if unsets:
+            update['$unset'] = unsets
+        if update:
+            self._get_collection().update_one({'_id': self.pk}, update)
+        # 已写库的修改同步到对象，不计入 _changed_fields，避免之后 save 重复写
+        for doc, key, value in applies:
+            changed_fields = list(doc._changed_fields)
+            setattr(doc, key, value)
+            doc._changed_fields = changed_fields
+        return update
+
+    @classmethod
+    def bulk_create_with(cls, data_list, ignore_fields=None, chunk_size=1000):
+        """
+            批量 create_with：逐行转换并校验，再按 chunk_size 分块以无序 bulk_write 写入，单行出错不影响其它行
+            不经过 save，子类重写的 save 及 save 信号不会执行
+        :param data_list: [data_dict]
+        :return: (写入成功的文档列表, [(行号, 错误信息)])
+        """
+        items, errors = [], []
+        for index, data_dict in enumerate(data_list):
+            try:
+                doc = cls.create_with(data_dict, ignore_fields)
+                doc.validate()
+                son = doc.to_mongo()
+                if '_id' not in son:
+                    son['_id'] = doc.pk = ObjectId()
+            except Exception as e:
+                errors.append((index, str(e)))
+                continue
+            items.append((index, doc, InsertOne(son)))
+        return cls._bulk_write(items, errors, chunk_size), errors
+
+    @classmethod
+    def bulk_update_with(cls, pairs, ignore_fields=None, chunk_size=1000):
+        """
+            批量 update_with：逐行合并并校验，仅将变化的字段以 $set/$unset 写入，按 chunk_size 分块无序 bulk_write
+        :param pairs: [(文档 或 主键, data_dict)]，传主键时一次查询加载全部文档
+        :return: (写入成功的文档列表, [(行号, 错误信息)])
+        """
+        pairs = list(pairs)
+        id_field = cls._fields[cls._meta.get('id_field') or 'id']
+        pks = set()
+        for obj, _ in pairs:
+            if not isinstance(obj, cls):
+                pk = _to_pk(cls, obj)
+                try:
+                    id_field.validate(pk)
+                except Exception:
+                    # 无效主键不参与查询，该行按不存在记错
+                    continue
+                pks.add(pk)
+        loaded = get_many_by_pk(cls, pks) if pks else {}
+        items, errors = [], []
+        for index, (obj, data_dict) in enumerate(pairs):
+            try:
+                # get_many_by_pk 以转换后的主键(如ObjectId)为键，传入的字符串主键需同样转换
+                doc = obj if isinstance(obj, cls) else loaded.get(_to_pk(cls, obj))
+                if doc is None:
+                    raise cls.DoesNotExist('%s matching pk %s does not exist' % (cls.__name__, obj))
+                doc.update_with(data_dict, ignore_fields)
+                doc.validate()
+                sets, unsets = doc._delta()
+            except Exception as e:
+                errors.append((index, str(e)))
+                continue
+            update = {}
+            if sets:
+                update['$set'] = sets
+            if unsets:
+                update['$unset'] = unsets
+            items.append((index, doc, UpdateOne({'_id': doc.pk}, update) if update else None))
+        return cls._bulk_write(items, errors, chunk_size), errors
+
+    @classmethod
+    def _bulk_write(cls, items, errors, chunk_size=1000):
+        """
+        :param items: [(行号, 文档, 写操作)]，写操作为None表示无需写入
+        :param errors: BulkWriteError 中的失败项按行号追加到此列表
+        """
+        collection = cls._get_collection()
+        written = []
+        for start in range(0, len(items), chunk_size):
+            chunk = [item for item in items[start:start + chunk_size] if item[2] is not None]
+            failed = set()
+            if chunk:
+                try:
+                    collection.bulk_write([op for _, _, op in chunk], ordered=False)
+                except BulkWriteError as e:
+                    for err in e.details.get('writeErrors', []):
+                        failed.add(err['index'])
+                        errors.append((chunk[err['index']][0], err.get('errmsg')))
+            failed_rows = {chunk[i][0] for i in failed}
+            for index, doc, _ in items[start:start + chunk_size]:
+                if index not in failed_rows:
+                    doc._created = False
+                    doc._clear_changed_fields()
+                    written.append(doc)
+        errors.sort(key=lambda x: x[0])
+        return written
+
     @staticmethod
     def update_document(document, data_dict):
-        def field_value(field, value):
-            if field.__class__ in (fields.ListField, fields.SortedListField):
-                if value is None:
-                    return None
-                else:
-                    return [
-                        field_value(field.field, item)
-                        for item in value
-                    ]
-            if field.__class__ in (
-                    fields.ReferenceField,
-            ) and type(value) in (ObjectId, str):
-                return field.document_type.objects.get(pk=value)
-            elif field.__class__ in (DateTimeField, DateField):
-                if type(value) is str:
-                    if field.__class__ is DateField:
-                        return parser.parse(value).date()
-                    else:
-                        return parser.parse(value)
-                else:
-                    return value
-            elif field.__class__ in (
-                    fields.EmbeddedDocumentField,
-                    fields.ReferenceField,
-                    fields.GenericEmbeddedDocumentField,
-                    fields.GenericReferenceField
-            ):
-                if hasattr(field.document_type, 'create_with') and field.document_type._restruct_:
-                    return field.document_type.create_with(value)
-                else:
-                    return field.document_type(**value)
-            else:
-                return value
-
+        converters = get_converters(document.__class__)
         for key, value in data_dict.items():
             try:
-                field = document._fields[key]
-                if isinstance(field, (EmbeddedDocumentField, ReferenceField, ListField, EmbeddedDocumentListField)) and value is None:
-                    setattr(document, key, None)
-                else:
-                    setattr(
-                        document, key,
-                        field_value(field, value)
-                    )
+                setattr(document, key, converters[key](value))
             except Exception as e:
                 raise Exception('err field %s - value %s | %s' % (key, str(value), str(e)))
 
@@ -241,7 +518,10 @@ class DocumentMixin:
 
     @classmethod
     def ensure_indexes(cls):
-        return
+        """Mixin 位于 Document 之前时，交回 mongoengine 的索引创建"""
+        ensure_indexes = getattr(super(DocumentMixin, cls), 'ensure_indexes', None)
+        if ensure_indexes is not None:
+            return ensure_indexes()
 
     # ----------------------- reference fields 相关处理 -----------------------
     # LazyReferenceField 必须先fetch后使用,不符合需要的处理方式
@@ -260,7 +540,8 @@ class DocumentMixin:
             try:
                 if '.' not in field_key:
                     if isinstance(field, ListField) and isinstance(field.field, ReferenceField):
-                        self._data[field_key] = [source[dbref.id] for dbref in self._data[field_key]]
+                        if self._data.get(field_key):
+                            self._data[field_key] = [source[dbref.id] for dbref in self._data[field_key]]
                     elif self._data.get(field_key):
                         self._data[field_key] = source[self._data[field_key].id]
             except Exception as e:
@@ -274,12 +555,12 @@ class DocumentMixin:
                 else:
                     suffix_dic[attr].append(suffix)
         for attr, suffix in suffix_dic.items():
-            if attr in self._data:
-                if isinstance(self._data[attr], list):
-                    for x in self._data[attr]:
-                        x.fill_refer(refer_cls, source)
-                else:
-                    self._data[attr].fill_refer(refer_cls, source)
+            value = self._data.get(attr)
+            if value is None:
+                continue
+            for x in (value if isinstance(value, list) else [value]):
+                if x is not None:
+                    x.fill_refer(refer_cls, source)
 
     @classmethod
     def fill_qs_refer(cls, qs_list, refer_cls, source=None) -> list:
@@ -296,7 +577,7 @@ class DocumentMixin:
             for d in qs_list:
                 for i in d.get_all_ref_ids(ref_fields):
                     ids.add(i)
-            source = {i.id: i for i in refer_cls.ori_objects(id__in=ids)}
+            source = get_many_by_pk(refer_cls, ids, manager='ori_objects')
         for d in qs_list:
             d.fill_refer(refer_cls, source, fields_dic)
 
@@ -360,22 +641,99 @@ class DocumentMixin:
                 else:
                     suffix_dic[attr].append(suffix)
         for attr, suffix in suffix_dic.items():
-            if attr in self._data:
-                if isinstance(self._data[attr], list):
-                    for x in self._data[attr]:
-                        ids.extend(x.get_all_ref_ids(suffix))
-                else:
-                    ids.extend(self._data[attr].get_all_ref_ids(suffix))
+            value = self._data.get(attr)
+            if value is None:
+                continue
+            for x in (value if isinstance(value, list) else [value]):
+                if x is not None:
+                    ids.extend(x.get_all_ref_ids(suffix))
         return ids
 
     def get_all_ref_obj_dict(self, refer_cls, ref_fields):
         ids = self.get_all_ref_ids(ref_fields)
-        res = refer_cls.ori_objects(id__in=ids)
-        return {i.id: i for i in res}
+        return get_many_by_pk(refer_cls, ids, manager='ori_objects')
 
     @classmethod
-    def fill_qs_refer_all(cls, qs):
-        fields = cls.get_reference_fields()
-        for field in fields:
-            cls.fill_qs_refer(qs, field.document_type)
+    def get_reference_targets(cls):
+        """
+            全部引用字段(含嵌套、列表路径)按目标类分组
+        :return: {refer_cls: ['key', 'emb.key']}
+        """
+        if '_reference_targets_' in cls.__dict__:
+            return cls._reference_targets_
+        res = {}
+
+        def _add(refer_cls, path):
+            res.setdefault(refer_cls, []).append(path)
+        for f, v in cls._fields.items():
+            if isinstance(v, ListField):
+                v = v.field
+            if isinstance(v, ReferenceField):
+                _add(v.document_type, f)
+            elif isinstance(v, EmbeddedDocumentField) and hasattr(v.document_type, 'get_reference_targets'):
+                for refer_cls, paths in v.document_type.get_reference_targets().items():
+                    for p in paths:
+                        _add(refer_cls, '%s.%s' % (f, p))
+        cls._reference_targets_ = res
+        return res
+
+    def get_all_dbrefs(self, fields):
+        """同 get_all_ref_ids，但返回DBRef(含collection)"""
+        refs = []
+        suffix_dic = {}
+        for field_key in fields:
+            if '.' not in field_key:
+                dbref = self._data.get(field_key)
+                if dbref:
+                    refs.extend(dbref if isinstance(dbref, list) else [dbref])
+            else:
+                attr, suffix = field_key.split('.', 1)
+                suffix_dic.setdefault(attr, []).append(suffix)
+        for attr, suffix in suffix_dic.items():
+            value = self._data.get(attr)
+            if value:
+                for x in (value if isinstance(value, list) else [value]):
+                    if x is not None:
+                        refs.extend(x.get_all_dbrefs(suffix))
+        return refs
+
+    @classmethod
+    def fill_qs_refer_all(cls, qs, max_workers=4):
+        """
+            列表接口的 select_related：
+            按目标类收集整页数据的引用id(同一collection可能对应多个文档类，不以collection分组)，
+            各目标类的 $in 查询在线程池中并发执行，结果原地填充 _data
+        :param qs: 文档列表，QuerySet会先转为列表
+        :param max_workers: 并发查询的线程数
+        """
+        if not isinstance(qs, list):
+            qs = list(qs)
+        targets = cls.get_reference_targets()
+        if not qs or not targets:
+            return qs
+        ids = {refer_cls: set() for refer_cls in targets}
+        for refer_cls, fields in targets.items():
+            for d in qs:
+                ids[refer_cls].update(ref.id for ref in d.get_all_dbrefs(fields))
+
+        # identity map 依赖请求上下文，先在当前线程取出已缓存部分，线程池只查询缺失的id
+        sources = {}
+        for refer_cls in targets:
+            sources[refer_cls], ids[refer_cls] = get_cached(refer_cls, ids[refer_cls], 'ori_objects')
+
+        def _load(refer_cls):
+            return refer_cls, list(get_manager(refer_cls, 'ori_objects')(id__in=ids[refer_cls]))
+        to_load = [refer_cls for refer_cls in targets if ids[refer_cls]]
+        if to_load:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(to_load)))) as pool:
+                for refer_cls, objs in pool.map(_load, to_load):
+                    remember(*objs, manager='ori_objects', document_cls=refer_cls)
+                    sources[refer_cls].update({i.id: i for i in objs})
+        sources = {refer_cls: source for refer_cls, source in sources.items() if source}
+        if not sources:
+            return qs
+        for refer_cls, source in sources.items():
+            fields_dic = cls.get_reference_fields_dic(refer_cls)
+            for d in qs:
+                d.fill_refer(refer_cls, source, fields_dic)
         return qs
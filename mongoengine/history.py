@@ -1,11 +1,20 @@
 import time
+import atexit
 import datetime
 import json
+import threading
+from functools import wraps
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from bson import ObjectId
-from mongoengine import StringField, DynamicField
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+from mongoengine import StringField, DynamicField, IntField, ObjectIdField, Q
+from mongoengine.errors import SaveConditionError, NotUniqueError
 from mongoengine.base.common import get_document
-from ..webbase.json import JSONEncoder
-from .compare_diff import get_diff, get_attr
+from ..webbase.json import dumps
+from .compare_diff import get_diff, get_attr, get_patch, apply_patch, plain_copy, patch_root_keys
+from .document import son_cache, reset_son_cache
+from .history_writer import get_history_writer
 
 """
     历史记录的解决方案：
@@ -18,10 +27,89 @@ from .compare_diff import get_diff, get_attr
 """
 
 
+# diff_timeline 的结果缓存，历史记录不会改变，按 (历史类, 记录a的id, 记录b的id, mask) 缓存
+TIMELINE_CACHE_SIZE = 1024
+_timeline_cache = OrderedDict()
+_timeline_cache_lock = threading.Lock()
+# diff_timeline 共用的进程池，首次需要时创建，进程退出时关闭
+_timeline_pool = None
+_timeline_pool_lock = threading.Lock()
+
+
+def get_timeline_pool(max_workers=None):
+    """进程池只创建一次，max_workers 仅在首次创建时生效"""
+    global _timeline_pool
+    if _timeline_pool is None:
+        with _timeline_pool_lock:
+            if _timeline_pool is None:
+                _timeline_pool = ProcessPoolExecutor(max_workers=max_workers)
+                atexit.register(_timeline_pool.shutdown)
+    return _timeline_pool
+
+
+def _diff_pair(args):
+    """进程池中执行的比较任务"""
+    old, new, mask, keys = args
+    return get_diff(old, new, mask, keys)
+
+
+def _with_history_indexes(ensure_indexes):
+    @wraps(ensure_indexes)
+    def wrapper(cls):
+        res = ensure_indexes(cls)
+        cls.ensure_history_indexes()
+        return res
+    wrapper._history_indexes_ = True
+    return wrapper
+
+
+class HistoryConflictError(Exception):
+    """rev 模式下保存时文档已被他人修改"""
+
+
 class HistoryMixin:
     """
         保存历史 使用注意：必须用默认id 主键
+        history_change_detect 变更检测方式：
+            compare  读取库中当前文档，与本对象的 db_dict 比较（默认）
+            rev      依据 _changed_fields 判断是否有修改，以 _rev 计数做乐观锁条件写入，不再读库比较；
+                     写入时发现 _rev 已变化抛出 HistoryConflictError
+        history_write_behind 为 True 时历史记录交给后台线程批量写入(见 history_writer)，此时记录总是完整快照
     """
+    history_change_detect = 'compare'
+    history_write_behind = False
+    history_rev = IntField(db_field='_rev')
+
+    def _write_history_(self, history_cls, content, desc=None, version=None, last=None):
+        if not self.history_write_behind:
+            return history_cls.snapshot(content, desc, version, last)
+        # 上一版本可能仍在队列中，无法作为差异基准
+        record = history_cls.make_record(content, desc, version, delta=False)
+        get_history_writer().put(record)
+        return record
+
+    def _save_by_rev_(self, save, desc=None, version=None, force=False, **kwargs):
+        history_cls = self.get_history_document()
+        created = self._created or self.pk is None
+        if not created and not force and not self._get_changed_fields():
+            return self
+        rev = self.history_rev
+        if hasattr(self, 'update_time'):
+            self.update_time = datetime.datetime.utcnow()
+        self.history_rev = (rev or 0) + 1
+        if not created:
+            save_condition = dict(kwargs.get('save_condition') or {})
+            save_condition['history_rev'] = rev
+            kwargs['save_condition'] = save_condition
+        # 保存与写历史共用一次 to_mongo
+        with son_cache():
+            try:
+                res = save(**kwargs)
+            except SaveConditionError:
+                self.history_rev = rev
+                raise HistoryConflictError('%s %s 已被修改(rev %s)，请刷新后重试' % (type(self).__name__, self.pk, rev))
+            self._write_history_(history_cls, self.db_dict, desc, version)
+        return res
 
     @classmethod
     def get_history_document(cls):
@@ -36,19 +124,18 @@ class HistoryMixin:
         :param kwargs:
         :return:
         """
+        if self.history_change_detect == 'rev':
+            return self._save_by_rev_(self.save, desc, version, **kwargs)
         pk = self.pk
         history_cls = self.get_history_document()
         content = type(self).objects.get(pk=pk)
-        if self.db_dict == content.db_dict:
-            return self
-        res = self.save(**kwargs)
-        snapshot = history_cls(
-            content=self.db_dict,
-            desc=desc
-        )
-        if version:
-            snapshot.version = version
-        snapshot.save()
+        with son_cache():
+            if self.db_dict == content.db_dict:
+                return self
+            # save 中 clean() 可能修改嵌入字段，保存前丢弃比较时的缓存；保存与写历史共用一次 to_mongo
+            reset_son_cache()
+            res = self.save(**kwargs)
+            self._write_history_(history_cls, self.db_dict, desc, version)
         return res
 
     def _save_(self, desc=None, version=None, force=False, **kwargs):
@@ -59,29 +146,26 @@ class HistoryMixin:
                 :return:
                 """
         cls = type(self)
+        if self.history_change_detect == 'rev':
+            return self._save_by_rev_(super(cls, self).save, desc, version, force, **kwargs)
         pk = self.pk
         history_cls = self.get_history_document()
         content = cls.objects(pk=pk).first() if pk else None
-        if content and not force and self.db_dict == content.db_dict:
-            return self
-        self.update_time = datetime.datetime.utcnow()
-        res = super(cls, self).save(**kwargs)
-        snapshot = history_cls(
-            content=self.db_dict,
-            desc=desc
-        )
-        if version:
-            snapshot.version = version
-        snapshot.save()
+        with son_cache():
+            if content and not force and self.db_dict == content.db_dict:
+                return self
+            self.update_time = datetime.datetime.utcnow()
+            reset_son_cache()
+            res = super(cls, self).save(**kwargs)
+            self._write_history_(history_cls, self.db_dict, desc, version)
         return res
 
     def snapshot(self):
         history_cls = self.get_history_document()
-        db_last_version = history_cls.objects(__raw__={"content._id": self.id}).order_by('-create_time').first()
-        if not db_last_version or db_last_version.content != self.db_dict:
-            db_last_version = history_cls(
-                content=self.db_dict
-            ).save()
+        db_last_version = history_cls.get_last(self.id)
+        content = self.db_dict
+        if not db_last_version or db_last_version.full_content != content:
+            db_last_version = self._write_history_(history_cls, content, last=db_last_version)
         return db_last_version.id
 
     @property
@@ -92,35 +176,162 @@ class HistoryMixin:
         """
         cls = type(self)
         history_cls = self.get_history_document()
-        db_last_version = history_cls.objects(__raw__={"content._id": self.id}).order_by('-create_time').first()
-        if db_last_version and db_last_version.content == cls.objects.get(pk=self.pk).db_dict:
+        db_last_version = history_cls.get_last(self.id)
+        if db_last_version and db_last_version.full_content == cls.objects.get(pk=self.pk).db_dict:
             return db_last_version.version
 
     def diff(self, record):
-        return get_diff(record.content, self.to_mongo().to_dict())
+        return get_diff(record.full_content, self.to_mongo().to_dict())
 
 
 class History:
+    """
+        keyframe_interval 历史存储方式：
+            0   每个版本保存完整快照（默认）
+            n   每 n 个版本保存一次完整快照(关键帧)，其间的版本只保存与上一版本的 JSON-patch 差异，
+                库中 content 仅保留 {'_id': id}(对象上为 stored_content)，还原一个版本最多应用 n-1 个差异
+        content 与 full_content 均为该版本的完整内容，content_obj/_content_/content_json/diff 均基于完整内容
+        同一关键帧下 chain 唯一(ensure_history_indexes)，并发保存产生相同 chain 时改存完整快照
+        ref_id 为所属文档id，与 create_time 建联合索引(ensure_history_indexes)；
+        早期没有 ref_id 的记录查询时退回 content._id，可用 backfill_ref_id 补齐
+    """
     _model_desc_ = 'auto history'
     document_type = None
+    keyframe_interval = 0
     desc = StringField(version_name="描述")
-    content = DynamicField(db_field='content', verbose_name="历史数据快照")
+    stored_content = DynamicField(db_field='content', verbose_name="历史数据快照，差异记录仅含 {'_id': id}")
     version = StringField(version_name="版本号", default=lambda: str(int(time.time() * 10 ** 6)))
+    patch = DynamicField(verbose_name="与上一版本的差异")
+    chain = IntField(default=0, verbose_name="距关键帧的版本数")
+    keyframe = ObjectIdField(verbose_name="所属关键帧")
+    ref_id = ObjectIdField(verbose_name="所属文档id")
 
     @classmethod
-    def snapshot(cls, content, desc=None):
-        return cls(content=content, desc=desc).save()
+    def ensure_history_indexes(cls):
+        collection = cls._get_collection()
+        collection.create_index([('ref_id', ASCENDING), ('create_time', DESCENDING)], background=True)
+        collection.create_index([('keyframe', ASCENDING), ('chain', ASCENDING)], unique=True, background=True,
+                                partialFilterExpression={'keyframe': {'$exists': True}})
+
+    def __init_subclass__(cls, **kwargs):
+        """
+            常见写法为 class XHistory(Document, History)，History 中定义的 ensure_indexes 会被 Document 覆盖，
+            因此在子类上包装 ensure_indexes，mongoengine 自动建索引或手动调用时同时创建历史索引
+        """
+        super().__init_subclass__(**kwargs)
+        method = getattr(cls, 'ensure_indexes', None)
+        if method is not None and not getattr(method, '_history_indexes_', False):
+            cls.ensure_indexes = classmethod(_with_history_indexes(method.__func__))
+
+    @classmethod
+    def find_last(cls, content_id, **raw):
+        """按 ref_id 查询最新一条，未找到时按 content._id 查询早期记录"""
+        for key in ('ref_id', 'content._id'):
+            record = cls.objects(__raw__=dict(raw, **{key: content_id})).order_by('-create_time').first()
+            if record is not None:
+                return record
+
+    @classmethod
+    def get_last(cls, content_id):
+        return cls.find_last(content_id)
+
+    @classmethod
+    def latest_versions(cls, ids):
+        """
+            一次聚合查询一组文档各自的最新版本号
+        :return: {id: version}，没有历史记录的id不在结果中
+        """
+        ids = [ObjectId(i) if type(i) is str else i for i in ids]
+        pipeline = [
+            {'$match': {'ref_id': {'$in': ids}}},
+            {'$sort': {'ref_id': 1, 'create_time': -1}},
+            {'$group': {'_id': '$ref_id', 'version': {'$first': '$version'}}},
+        ]
+        return {i['_id']: i['version'] for i in cls._get_collection().aggregate(pipeline)}
+
+    @classmethod
+    def backfill_ref_id(cls, batch_size=1000):
+        """为早期记录补写 ref_id，返回更新的条数"""
+        collection = cls._get_collection()
+        cursor = collection.find({'ref_id': {'$exists': False}, 'content._id': {'$exists': True}}, {'content._id': 1})
+        ops, total = [], 0
+        for doc in cursor:
+            ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {'ref_id': doc['content']['_id']}}))
+            if len(ops) >= batch_size:
+                total += collection.bulk_write(ops, ordered=False).modified_count
+                ops = []
+        if ops:
+            total += collection.bulk_write(ops, ordered=False).modified_count
+        return total
+
+    @classmethod
+    def make_record(cls, content, desc=None, version=None, last=None, delta=True):
+        """
+            生成(未保存的)历史记录，按 keyframe_interval 决定存完整快照还是差异
+        :param last: 该文档最新的历史记录，不传时查询
+        :param delta: False 时总是存完整快照
+        """
+        record = cls(stored_content=content, desc=desc, ref_id=content.get('_id'))
+        if version:
+            record.version = version
+        if delta and cls.keyframe_interval > 1 and '_id' in content:
+            last = last or cls.get_last(content['_id'])
+            if last is not None and last.chain + 1 < cls.keyframe_interval:
+                base = last.full_content
+                patch = get_patch(base, content)
+                # 差异无法准确还原时（如数据含不可比较的类型）退回完整快照
+                if apply_patch(base, patch) == content:
+                    record.stored_content = {'_id': content['_id']}
+                    record.patch = patch
+                    record.chain = last.chain + 1
+                    record.keyframe = last.keyframe or last.id
+        return record
+
+    @classmethod
+    def snapshot(cls, content, desc=None, version=None, last=None):
+        record = cls.make_record(content, desc, version, last)
+        try:
+            return record.save()
+        except NotUniqueError:
+            # 并发保存基于同一上一版本生成了相同的 chain，改存完整快照
+            return cls.make_record(content, desc, version, delta=False).save()
+
+    @property
+    def is_keyframe(self):
+        return not self.chain
+
+    @property
+    def full_content(self):
+        """该版本的完整内容，差异记录从关键帧逐个应用差异还原"""
+        if self.is_keyframe:
+            return self.stored_content
+        if '_full_content_' not in self.__dict__:
+            self.__dict__['_full_content_'] = self.reconstruct()
+        return self.__dict__['_full_content_']
+
+    def reconstruct(self):
+        records = type(self).objects(Q(id=self.keyframe) | Q(keyframe=self.keyframe, chain__lte=self.chain))\
+            .only('stored_content', 'patch', 'chain').order_by('chain')
+        content = None
+        for record in records:
+            content = record.stored_content if record.is_keyframe else apply_patch(content, record.patch)
+        return content
+
+    @property
+    def content(self):
+        """该版本的完整内容，同 full_content"""
+        return self.full_content
 
     @property
     def content_obj(self):
         obj = self.document_type()
-        obj.update_with(self.content, ignore_fields=[])
+        obj.update_with(self.full_content, ignore_fields=[])
         return obj
         # return self.document_type(**self.content)
 
     @property
     def _content_(self):
-        content = self.content
+        content = dict(self.full_content)
         if '_id' in content:
             content['id'] = content['_id']
             del content['_id']
@@ -132,16 +343,86 @@ class History:
 
     @classmethod
     def get_by(cls, content_id, version):
+        """返回的记录可能是差异记录，其 content 仍为还原后的完整内容"""
         if type(content_id) is str:
             content_id = ObjectId(content_id)
-        return cls.objects(__raw__={"content._id": content_id, "version": version}).order_by('-create_time').first()
+        return cls.find_last(content_id, version=version)
 
     @property
     def content_json(self):
-        if self.content:
-            content_str = json.dumps(self.content, cls=JSONEncoder)
+        content = self.full_content
+        if content:
+            content_str = dumps(content)
             return json.loads(content_str)
 
     def diff(self, record):
-        return get_diff(record.content, self.content)
+        return get_diff(record.full_content, self.full_content)
 
+    timeline_pool_threshold = 50
+
+    @classmethod
+    def load_timeline(cls, content_id):
+        """
+            一次查询取出文档的全部历史记录，并依次还原完整内容
+        :return: [(record, content)]，按 create_time 排序
+        """
+        if type(content_id) is str:
+            content_id = ObjectId(content_id)
+        records = list(cls.objects(__raw__={'$or': [{'ref_id': content_id}, {'content._id': content_id}]})
+                       .order_by('create_time'))
+        contents, chains = {}, {}
+        # 同一关键帧下按 chain 依次应用差异，每个版本只应用一次
+        for record in sorted(records, key=lambda r: r.chain):
+            if record.is_keyframe:
+                content = plain_copy(record.stored_content)
+                chains.setdefault(record.id, {})[0] = content
+            else:
+                base = chains.get(record.keyframe, {}).get(record.chain - 1)
+                content = apply_patch(base, record.patch) if base is not None else plain_copy(record.full_content)
+                chains.setdefault(record.keyframe, {})[record.chain] = content
+            contents[record.id] = content
+        return [(record, contents[record.id]) for record in records]
+
+    @staticmethod
+    def _changed_keys(record1, record2):
+        """record2 是 record1 的下一个差异版本时，直接由 patch 得到变化的顶层key"""
+        if not record2.is_keyframe and record2.keyframe == (record1.keyframe or record1.id) \
+                and record2.chain == record1.chain + 1:
+            return patch_root_keys(record2.patch)
+
+    @classmethod
+    def diff_timeline(cls, content_id, versions=None, mask=None, max_workers=None):
+        """
+            整条时间线上相邻版本的差异
+            相邻的差异记录只比较 patch 涉及的顶层key；待比较的版本对不少于 timeline_pool_threshold 时
+            使用模块共用的进程池(get_timeline_pool)，否则在当前进程计算
+        :param versions: 按顺序给出要比较的版本号，默认全部版本
+        :param max_workers: 共用进程池首次创建时的进程数
+        :return: [{'from': version_a, 'to': version_b, 'diff': get_diff 结果}]
+        """
+        items = cls.load_timeline(content_id)
+        if versions is not None:
+            by_version = {record.version: (record, content) for record, content in items}
+            items = [by_version[v] for v in versions if v in by_version]
+        results, todo = [], []
+        for (record1, content1), (record2, content2) in zip(items, items[1:]):
+            key = (cls, record1.id, record2.id, tuple(mask or ()))
+            with _timeline_cache_lock:
+                diff = _timeline_cache.get(key)
+                if diff is not None:
+                    _timeline_cache.move_to_end(key)
+            results.append({'from': record1.version, 'to': record2.version, 'diff': diff})
+            if diff is None:
+                todo.append((results[-1], key, (content1, content2, mask, cls._changed_keys(record1, record2))))
+        if len(todo) >= cls.timeline_pool_threshold:
+            pool = get_timeline_pool(max_workers)
+            diffs = list(pool.map(_diff_pair, [args for _, _, args in todo], chunksize=8))
+        else:
+            diffs = [_diff_pair(args) for _, _, args in todo]
+        with _timeline_cache_lock:
+            for (result, key, _), diff in zip(todo, diffs):
+                result['diff'] = diff
+                _timeline_cache[key] = diff
+            while len(_timeline_cache) > TIMELINE_CACHE_SIZE:
+                _timeline_cache.popitem(last=False)
+        return results
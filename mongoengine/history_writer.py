@@ -0,0 +1,158 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+from bson import ObjectId
+logger = logging.getLogger(__name__)
+
+"""
+    历史记录异步写入(write-behind)：
+    HistoryMixin.history_write_behind = True 时，历史记录不再随保存同步写入，而是进入进程内有界队列，
+    由后台线程按批 insert_many 写库。
+        背压        队列满时等待 put_timeout 秒，仍无空位则退回同步写入，不丢数据
+        退出        进程退出时(atexit)写完队列中剩余记录
+        监控        metrics: 队列深度 depth、最早未写记录的等待秒数 lag、各类计数
+    注意：记录 id 在入队时生成；队列中的记录写库前查询不到；写入失败只记日志与计数。
+"""
+
+
+class HistoryWriter(object):
+    def __init__(self, max_size=10000, batch_size=500, flush_interval=0.5, put_timeout=1.0):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.counts = {'enqueued': 0, 'written': 0, 'sync_written': 0, 'failed': 0, 'batches': 0}
+        self._counts_lock = threading.Lock()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._atexit_registered = False
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._closing.clear()
+            self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.close)
+                self._atexit_registered = True
+
+    def put(self, record):
+        """
+        :param record: 未保存的历史记录(History 文档对象)
+        :return: 入队时生成的记录id
+        """
+        son = record.to_mongo()
+        if '_id' not in son:
+            son['_id'] = ObjectId()
+        record.id = son['_id']
+        history_cls = type(record)
+        if self._closing.is_set():
+            self._write_sync(history_cls, son)
+            return son['_id']
+        self.start()
+        try:
+            self.queue.put((history_cls, son, time.time()), timeout=self.put_timeout)
+            self._count('enqueued')
+        except queue.Full:
+            logger.warning('history queue full (%s), write synchronously' % self.queue.maxsize)
+            self._write_sync(history_cls, son)
+        return son['_id']
+
+    def _write_sync(self, history_cls, son):
+        history_cls._get_collection().insert_one(son)
+        self._count('sync_written')
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._closing.is_set():
+                    return
+                continue
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        groups = {}
+        for history_cls, son, _ in batch:
+            groups.setdefault(history_cls, []).append(son)
+        try:
+            for history_cls, sons in groups.items():
+                try:
+                    history_cls._get_collection().insert_many(sons, ordered=False)
+                    self._count('written', len(sons))
+                except Exception as e:
+                    self._count('failed', len(sons))
+                    logger.exception('history write-behind failed for %s: %s' % (history_cls.__name__, e))
+            self._count('batches')
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    def _count(self, key, n=1):
+        """put/_write_sync 在调用方线程执行，计数需加锁"""
+        with self._counts_lock:
+            self.counts[key] += n
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    @property
+    def lag(self):
+        """队列中最早一条记录已等待的秒数，队列为空时为0"""
+        with self.queue.mutex:
+            oldest = self.queue.queue[0][2] if self.queue.queue else None
+        return time.time() - oldest if oldest else 0
+
+    @property
+    def metrics(self):
+        with self._counts_lock:
+            counts = dict(self.counts)
+        return dict(counts, depth=self.depth, lag=self.lag)
+
+    def flush(self, timeout=None):
+        """等待队列中已有记录写完，返回是否在超时前完成"""
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=30):
+        self._closing.set()
+        if self._thread is not None and self._thread.is_alive():
+            self.flush(timeout)
+            self._thread.join(timeout=self.flush_interval * 2)
+
+
+_history_writer = None
+
+
+def get_history_writer():
+    global _history_writer
+    if _history_writer is None:
+        _history_writer = HistoryWriter()
+    return _history_writer
+
+
+def set_history_writer(writer):
+    """替换默认的写入器，如调整队列长度、批大小"""
+    global _history_writer
+    _history_writer = writer
@@ -0,0 +1,105 @@
+from functools import wraps
+from contextlib import contextmanager
+from flask import g, has_app_context
+
+"""
+    请求级的文档缓存(identity map)，以 文档类+manager名+id 为键保存在 flask.g 上。
+    不同 manager 的过滤条件不同(如 objects 过滤了软删除而 ori_objects 不过滤)，各自缓存，互不命中。
+    默认关闭，视图使用 use_identity_map 装饰器或 with identity_map(): 开启。
+    开启后 update_document / fill_refer / get_all_ref_obj_dict / get_object_or_404 先查缓存，
+    同一请求内同一文档只加载一次。未开启或不在应用上下文中时，行为与直接查询一致。
+"""
+_G_KEY = '_flex_identity_map'
+
+
+def get_identity_map():
+    if not has_app_context():
+        return None
+    return g.get(_G_KEY)
+
+
+@contextmanager
+def identity_map():
+    """开启当前请求的identity map，可嵌套，由最外层负责清理"""
+    if not has_app_context():
+        yield None
+        return
+    owner = g.get(_G_KEY) is None
+    if owner:
+        setattr(g, _G_KEY, {})
+    try:
+        yield g.get(_G_KEY)
+    finally:
+        if owner:
+            g.pop(_G_KEY, None)
+
+
+def use_identity_map(func):
+    @wraps(func)
+    def decorated_view(*args, **kwargs):
+        with identity_map():
+            return func(*args, **kwargs)
+    return decorated_view
+
+
+def _to_pk(document_cls, pk):
+    id_field = document_cls._meta.get('id_field') or 'id'
+    return document_cls._fields[id_field].to_python(pk)
+
+
+def get_manager(document_cls, manager='objects'):
+    """按名称取 manager，文档类没有该 manager(如未继承DocumentMixin时的 ori_objects)时退回 objects"""
+    queryset = getattr(document_cls, manager, None)
+    return queryset if queryset is not None else document_cls.objects
+
+
+def get_cached(document_cls, ids, manager='objects'):
+    """
+    :param manager: 加载所用 manager 的名称，只命中同一 manager 加载的文档
+    :return: (已缓存的 {id: obj}, 未缓存的id列表)
+    """
+    id_map = get_identity_map()
+    if id_map is None:
+        return {}, list(ids)
+    found, missing = {}, []
+    for i in ids:
+        obj = id_map.get((document_cls, manager, i))
+        if obj is None:
+            missing.append(i)
+        else:
+            found[i] = obj
+    return found, missing
+
+
+def remember(*objs, manager='objects', document_cls=None):
+    """
+    :param document_cls: 查询所用的文档类，默认取对象自身的类(继承时父类查询可能得到子类对象)
+    """
+    id_map = get_identity_map()
+    if id_map is None:
+        return
+    for obj in objs:
+        id_map[(document_cls or type(obj), manager, obj.pk)] = obj
+
+
+def get_by_pk(document_cls, pk, manager='objects'):
+    """按主键取单个文档，优先取identity map，不存在时抛出 DoesNotExist"""
+    pk = _to_pk(document_cls, pk)
+    found, missing = get_cached(document_cls, [pk], manager)
+    if not missing:
+        return found[pk]
+    obj = get_manager(document_cls, manager).get(pk=pk)
+    remember(obj, manager=manager, document_cls=document_cls)
+    return obj
+
+
+def get_many_by_pk(document_cls, ids, manager='objects'):
+    """按主键批量取文档，只查询identity map中没有的部分
+    :return: {id: obj}
+    """
+    found, missing = get_cached(document_cls, set(ids), manager)
+    if missing:
+        objs = list(get_manager(document_cls, manager)(id__in=missing))
+        remember(*objs, manager=manager, document_cls=document_cls)
+        found.update({i.id: i for i in objs})
+    return found
@@ -1,13 +1,75 @@
+import os
+import time
 import jieba
+import hashlib
 import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from bson import json_util
+from pymongo import UpdateOne
 from mongoengine import StringField, ListField, EmbeddedDocumentField
+from ..libs.boltons.setutils import IndexedSet
 logger = logging.getLogger(__name__)
 
+SEARCH_TOKEN_CACHE_SIZE = 100000
+# 分词缓存：键为原字符串的 blake2b 摘要，长文本不会常驻内存；按最近使用淘汰
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+
+def cut_for_search(text):
+    key = hashlib.blake2b(text.encode('utf-8')).digest()
+    with _token_cache_lock:
+        tokens = _token_cache.get(key)
+        if tokens is not None:
+            _token_cache.move_to_end(key)
+            return tokens
+    tokens = _cut_for_search(text)
+    with _token_cache_lock:
+        _token_cache[key] = tokens
+        if len(_token_cache) > SEARCH_TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return tokens
+
+
+def clear_token_cache():
+    with _token_cache_lock:
+        _token_cache.clear()
+
+
+def _cut_for_search(text):
+    return tuple(jieba.cut_for_search(text))
+
+
+def tokenize_texts(texts, cut=cut_for_search):
+    """结巴分词并按出现顺序去重，原字符串本身也作为一个tag"""
+    tags = IndexedSet()
+    for text in texts:
+        tags.update(cut(text))
+        tags.add(text)
+    return tags
+
+
+def is_str_list_field(field):
+    return type(field) is StringField or type(field) is ListField and \
+        (field.field == StringField or type(field.field) is StringField)
+
 
 class SearchMixin:
+    """
+        search_tags 分两步生成：get_search_texts 取出字符串，tokenize_texts 分词。
+        分词结果按字符串摘要缓存(cut_for_search)，并按 search_fields 的每一项缓存在对象上，
+        对象上的缓存以该项取出的字符串为准，字符串不变时不重新分词(save/reload 后同样适用)
+    """
     search_tags = StringField(verbose_name='全文搜索字段')
     search_fields = None
 
+    def get_search_fields(self):
+        if self.search_fields is not None:
+            return self.search_fields
+        return [key for key, field in self._fields.items() if is_str_list_field(field) and key != 'search_tags']
+
     def get_search_tags(self, fields=None):
         """
             将目标字符串都用结巴分词处理一遍，以便搜索
@@ -18,24 +80,26 @@ class SearchMixin:
             # __all_str__  表示将所有字符串（含深度两级内的复杂对象,默认级中的字符串）都放进search_tags中,
         :return:
         """
-        tags = []
+        tags = IndexedSet()
+        for texts in self.get_search_texts(fields).values():
+            tags.update(tokenize_texts(texts))
+        return list(tags)
+
+    def get_search_texts(self, fields=None):
+        """
+            取出需要分词的字符串
+        :return: {field: [str]}，field 为 fields 中的每一项
+        """
+        result = OrderedDict()
+        texts = []
 
         def _jieba_add_tags(val, field):
             if not val:
                 return
             if type(field) is StringField:
-                tags.extend(list(jieba.cut_for_search(val)))
-                if val not in tags:
-                    tags.append(val)
-            if type(field) is ListField and field.field == StringField:
-                for i in val:
-                    if i:
-                        tags.extend(list(jieba.cut_for_search(i)))
-                        if val not in tags:
-                            tags.append(val)
-
-        def is_str_list_field(field):
-            return type(field) is StringField or type(field) is ListField and field.field == StringField
+                texts.append(val)
+            elif is_str_list_field(field):
+                texts.extend(i for i in val if i)
 
         def _handle_attr(obj, attr_str):
             try:
@@ -86,9 +150,155 @@ class SearchMixin:
         if fields is None:
             fields = [key for key, field in self._fields.items() if is_str_list_field(field) and key != 'search_tags']
         for attr_str in fields:
+            texts = []
             _handle_attr(self, attr_str)
-        return tags
+            result[attr_str] = texts
+        return result
 
     def reset_search_tags(self):
-        tags = self.get_search_tags(self.search_fields)
+        # {field: (texts, tags)}，按字段取值而非 _changed_fields 判断是否失效
+        cache = self.__dict__.setdefault('_search_tokens_', {})
+        tags = IndexedSet()
+        for attr_str, texts in self.get_search_texts(self.get_search_fields()).items():
+            texts = tuple(texts)
+            cached = cache.get(attr_str)
+            if cached is None or cached[0] != texts:
+                cached = cache[attr_str] = (texts, tokenize_texts(texts))
+            tags.update(cached[1])
         self.search_tags = ' '.join(tags)
+
+
+def _tokenize_batch(batch):
+    """进程池中执行：[(pk, [str])] -> [(pk, search_tags)]；全量重建时字符串很少重复，不经过分词缓存"""
+    return [(pk, ' '.join(tokenize_texts(texts, cut=_cut_for_search))) for pk, texts in batch]
+
+
+class SearchReindexer(object):
+    """
+        批量重建 SearchMixin 文档的 search_tags
+        按 _id 顺序流式读取(只取 search_fields 涉及的顶层字段)，主进程取出字符串，进程池分词，
+        结果按批以无序 bulk_write $set 写回。
+        checkpoint 为文件路径时，每批写完记录最后一个 _id 及已处理数，中断后再次运行从该位置继续并沿用已处理数；
+        全部完成后删除该文件。
+        不经过 save，只更新 search_tags 字段。
+    """
+
+    def __init__(self, document_cls, batch_size=500, processes=None, checkpoint=None, query=None, log_interval=10):
+        """
+        :param processes: 分词进程数，默认cpu核数；0 表示在当前进程分词
+        :param query: 额外的过滤条件，如 {'status': 1}
+        :param log_interval: 进度日志的间隔秒数
+        """
+        self.document_cls = document_cls
+        self.batch_size = batch_size
+        self.processes = os.cpu_count() if processes is None else processes
+        self.checkpoint = checkpoint
+        self.query = query or {}
+        self.log_interval = log_interval
+        self.processed = 0
+        self._resumed = 0
+        self.started_at = None
+        self._last_log = 0
+
+    @property
+    def rate(self):
+        """本次运行每秒处理的文档数(不含从 checkpoint 恢复的部分)"""
+        elapsed = time.time() - self.started_at if self.started_at else 0
+        return (self.processed - self._resumed) / elapsed if elapsed > 0 else 0
+
+    @property
+    def stats(self):
+        return {'processed': self.processed, 'rate': self.rate,
+                'elapsed': time.time() - self.started_at if self.started_at else 0}
+
+    def load_checkpoint(self):
+        """:return: {'last_id': ..., 'processed': ...}，没有 checkpoint 时为空字典"""
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return {}
+        with open(self.checkpoint) as f:
+            return json_util.loads(f.read())
+
+    def save_checkpoint(self, last_id):
+        if not self.checkpoint:
+            return
+        tmp = self.checkpoint + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json_util.dumps({'last_id': last_id, 'processed': self.processed}))
+        os.replace(tmp, self.checkpoint)
+
+    def get_only_fields(self):
+        """
+            读取时只取 search_fields 涉及的顶层字段；不是文档字段的项(如属性、方法)不参与，
+            含 __all_str__ 时返回 None，不限制读取的字段
+        """
+        fields = self.get_search_fields()
+        if '__all_str__' in fields:
+            return None
+        model_fields = self.document_cls._fields
+        return [name for name in OrderedDict.fromkeys(f.split('.', 1)[0] for f in fields) if name in model_fields]
+
+    def get_queryset(self, last_id=None):
+        qs = self.document_cls.objects(**self.query)
+        if last_id is not None:
+            qs = qs(pk__gt=last_id)
+        only_fields = self.get_only_fields()
+        if only_fields is not None:
+            qs = qs.only(*only_fields)
+        return qs.order_by('pk').no_cache().timeout(False)
+
+    def get_search_fields(self):
+        return self.document_cls().get_search_fields()
+
+    def iter_batches(self, last_id=None):
+        fields = self.get_search_fields()
+        batch = []
+        for doc in self.get_queryset(last_id):
+            texts = [text for field_texts in doc.get_search_texts(fields).values() for text in field_texts]
+            batch.append((doc.pk, texts))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def write(self, results):
+        if not results:
+            return
+        db_field = self.document_cls._fields['search_tags'].db_field
+        ops = [UpdateOne({'_id': pk}, {'$set': {db_field: tags}}) for pk, tags in results]
+        self.document_cls._get_collection().bulk_write(ops, ordered=False)
+        self.processed += len(results)
+        self.save_checkpoint(results[-1][0])
+        if time.time() - self._last_log >= self.log_interval:
+            self._last_log = time.time()
+            logger.info('reindex %s search_tags: %s docs, %.1f docs/s' %
+                        (self.document_cls.__name__, self.processed, self.rate))
+
+    def run(self):
+        state = self.load_checkpoint()
+        last_id = state.get('last_id')
+        self.processed = self._resumed = state.get('processed', 0)
+        self.started_at = time.time()
+        if not self.processes:
+            for batch in self.iter_batches(last_id):
+                self.write(_tokenize_batch(batch))
+        else:
+            # 按提交顺序写回，保证 checkpoint 单调递增；在途批次数有上限，避免读取远快于分词时占满内存
+            pending = deque()
+            with ProcessPoolExecutor(self.processes) as pool:
+                for batch in self.iter_batches(last_id):
+                    pending.append(pool.submit(_tokenize_batch, batch))
+                    while len(pending) > self.processes * 2:
+                        self.write(pending.popleft().result())
+                while pending:
+                    self.write(pending.popleft().result())
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        logger.info('reindex %s search_tags done: %s docs, %.1f docs/s' %
+                    (self.document_cls.__name__, self.processed, self.rate))
+        return self.stats
+
+
+def reindex_search_tags(document_cls, **kwargs):
+    """重建整个集合的 search_tags，参数见 SearchReindexer"""
+    return SearchReindexer(document_cls, **kwargs).run()
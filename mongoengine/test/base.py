@@ -0,0 +1,14 @@
+import mongomock
+import mongoengine
+
+"""
+    测试用数据库连接：mongomock 内存库，测试类在 setUpClass/tearDownClass 中调用
+"""
+
+
+def connect():
+    mongoengine.connect('flex_test', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+
+
+def disconnect():
+    mongoengine.disconnect()
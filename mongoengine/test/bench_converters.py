@@ -0,0 +1,114 @@
+import time
+from mongoengine import Document, EmbeddedDocument, StringField, IntField, FloatField, DateTimeField, DateField, \
+    ListField, EmbeddedDocumentField, EmbeddedDocumentListField, ReferenceField, fields
+from ..document import DocumentMixin, get_converters
+
+try:
+    from dateutil import parser
+except ImportError:
+    from dateparser import parser
+
+"""
+    update_document 编译转换表与逐字段分派的对比，50个字段、含嵌入文档的宽文档：
+    python -m <package>.mongoengine.test.bench_converters
+"""
+
+
+class BenchAddress(EmbeddedDocument, DocumentMixin):
+    _restruct_ = True
+    city = StringField()
+    street = StringField()
+    moved_at = DateTimeField()
+
+
+def _make_attrs():
+    attrs = {'meta': {'collection': 'bench_wide'}}
+    for i in range(12):
+        attrs['s%s' % i] = StringField()
+        attrs['n%s' % i] = IntField()
+        attrs['f%s' % i] = FloatField()
+    for i in range(6):
+        attrs['t%s' % i] = DateTimeField()
+    for i in range(4):
+        attrs['d%s' % i] = DateField()
+    attrs['tags'] = ListField(StringField())
+    attrs['times'] = ListField(DateTimeField())
+    attrs['address'] = EmbeddedDocumentField(BenchAddress)
+    attrs['addresses'] = ListField(EmbeddedDocumentField(BenchAddress))
+    return attrs
+
+
+BenchWide = type('BenchWide', (Document, DocumentMixin), _make_attrs())
+
+
+def make_data():
+    data = {}
+    for i in range(12):
+        data['s%s' % i] = 'value %s' % i
+        data['n%s' % i] = i
+        data['f%s' % i] = i / 3
+    for i in range(6):
+        data['t%s' % i] = '2020-01-0%sT08:30:00' % (i + 1)
+    for i in range(4):
+        data['d%s' % i] = '2020-02-0%s' % (i + 1)
+    address = {'city': 'c', 'street': 's', 'moved_at': '2019-05-01T00:00:00Z'}
+    data.update(tags=['a', 'b', 'c'], times=['2020-03-01T00:00:00', '2020-03-02T00:00:00'],
+                address=address, addresses=[address, address])
+    return data
+
+
+def legacy_update_document(document, data_dict):
+    """原 update_document：每个键按 field.__class__ 重新分派，日期一律走 dateutil"""
+    def field_value(field, value):
+        if field.__class__ in (fields.ListField, fields.SortedListField):
+            if value is None:
+                return None
+            return [field_value(field.field, item) for item in value]
+        if field.__class__ in (fields.ReferenceField,) and type(value) in (str,):
+            return field.document_type.objects.get(pk=value)
+        elif field.__class__ in (DateTimeField, DateField):
+            if type(value) is str:
+                if field.__class__ is DateField:
+                    return parser.parse(value).date()
+                return parser.parse(value)
+            return value
+        elif field.__class__ in (fields.EmbeddedDocumentField, fields.ReferenceField,
+                                 fields.GenericEmbeddedDocumentField, fields.GenericReferenceField):
+            if hasattr(field.document_type, 'create_with') and field.document_type._restruct_:
+                document_type = field.document_type
+                obj = document_type()
+                legacy_update_document(obj, value)
+                return obj
+            return field.document_type(**value)
+        return value
+
+    for key, value in data_dict.items():
+        field = document._fields[key]
+        if isinstance(field, (EmbeddedDocumentField, ReferenceField, ListField, EmbeddedDocumentListField)) \
+                and value is None:
+            setattr(document, key, None)
+        else:
+            setattr(document, key, field_value(field, value))
+
+
+def bench(n=2000, repeat=3):
+    data = make_data()
+    assert len(BenchWide._fields) >= 50
+    get_converters(BenchWide)
+    results = {}
+    for name, run in (('legacy', lambda: legacy_update_document(BenchWide(), data)),
+                      ('compiled', lambda: BenchWide.create_with(data))):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(n):
+                run()
+            cost = time.perf_counter() - start
+            best = cost if best is None else min(best, cost)
+        results['%s x%s' % (name, n)] = best
+    return results
+
+
+if __name__ == '__main__':
+    for name, seconds in bench().items():
+        print('%-20s %.4fs' % (name, seconds))
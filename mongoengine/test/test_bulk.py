@@ -0,0 +1,44 @@
+import unittest
+from mongoengine import Document, StringField, IntField
+from ..document import DocumentMixin
+from .base import connect, disconnect
+
+
+class BulkItem(Document, DocumentMixin):
+    meta = {'collection': 'bulk_item'}
+    name = StringField()
+    age = IntField()
+
+
+class BulkUpdateTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        BulkItem.drop_collection()
+        self.items = [BulkItem(name='n%s' % i, age=i).save() for i in range(3)]
+
+    def test_update_by_pk(self):
+        a, b, c = self.items
+        written, errors = BulkItem.bulk_update_with([(str(a.id), {'age': 10}), (b.id, {'age': 11}),
+                                                     (c, {'name': 'c'}), ('bad-id', {'age': 1})])
+        self.assertEqual(len(written), 3)
+        self.assertEqual([i for i, _ in errors], [3])
+        self.assertEqual(BulkItem.objects.get(id=a.id).age, 10)
+        self.assertEqual(BulkItem.objects.get(id=b.id).age, 11)
+        self.assertEqual(BulkItem.objects.get(id=c.id).name, 'c')
+
+    def test_bulk_create(self):
+        written, errors = BulkItem.bulk_create_with([{'name': 'x', 'age': 1}, {'name': 'y', 'age': 'bad'}])
+        self.assertEqual(len(written), 1)
+        self.assertEqual([i for i, _ in errors], [1])
+        self.assertEqual(BulkItem.objects(name='x').count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
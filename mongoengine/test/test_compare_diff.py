@@ -0,0 +1,103 @@
+import time
+import difflib
+import unittest
+from .. import compare_diff
+from ..compare_diff import iter_diff, get_diff, get_patch, apply_patch, diff_str, myers_diff
+
+
+def legacy_diff_str(s1, s2):
+    """原基于 difflib.ndiff 的实现，作为输出格式的对照"""
+    results = []
+    last_sign = None
+    for r in difflib.ndiff(s1, s2):
+        sign, item = r[0], r[2:]
+        now_sign = 'strong' if sign == '+' else 'em' if sign == '-' else None
+        if now_sign != last_sign:
+            if last_sign:
+                results.append('</%s>' % last_sign)
+            if now_sign:
+                results.append('<%s>' % now_sign)
+        results.append(item)
+        last_sign = now_sign
+    if last_sign:
+        results.append('</%s>' % last_sign)
+    return ''.join(results)
+
+
+class IterDiffTest(unittest.TestCase):
+    def diff_paths(self, v1, v2, mask=None):
+        return {'.'.join(str(p) for p in path): (a, b) for path, a, b in iter_diff(v1, v2, mask)}
+
+    def test_equal_values_of_other_type(self):
+        self.assertEqual(self.diff_paths({'a': 1, 'b': True, 'c': 2}, {'a': 1.0, 'b': 1, 'c': 2.0}), {})
+        self.assertEqual(self.diff_paths({'a': 1}, {'a': 1.5}), {'a': (1, 1.5)})
+
+    def test_dict_to_none_one_level(self):
+        old = {'info': {'a': {'x': 1}, 'b': 2}}
+        self.assertEqual(self.diff_paths(old, {'info': None}), {'info.a': ({'x': 1}, None), 'info.b': (2, None)})
+        self.assertEqual(self.diff_paths({}, old), {'info.a': (None, {'x': 1}), 'info.b': (None, 2)})
+        self.assertEqual(self.diff_paths(old, {}, mask=['info.b']), {'info.a': ({'x': 1}, None)})
+
+    def test_nested_and_lists(self):
+        old = {'a': {'b': 1, 'c': [1, 2]}, 'items': [{'_id': 1, 'v': 1}, {'_id': 2, 'v': 2}]}
+        new = {'a': {'b': 2, 'c': [1]}, 'items': [{'_id': 2, 'v': 3}]}
+        self.assertEqual(self.diff_paths(old, new), {'a.b': (1, 2), 'a.c.1': (2, None), 'items.0.v': (2, 3),
+                                                     'items.1._id': (1, None), 'items.1.v': (1, None)})
+
+    def test_get_diff(self):
+        res = get_diff({'a': 'abc', 'b': 1, 'u': 1}, {'a': 'abd', 'b': 1.0, 'u': 2}, mask=['u'])
+        self.assertEqual(list(res), ['a'])
+
+    def test_patch_round_trip(self):
+        old = {'a': 1, 'b': {'c': [1, 2]}, 'd': 'x'}
+        new = {'a': 1.0, 'b': {'c': [1, 3]}, 'e/f': None}
+        self.assertEqual(apply_patch(old, get_patch(old, new)), new)
+
+
+class DiffStrTest(unittest.TestCase):
+    def test_same_markup_as_ndiff(self):
+        cases = [('abc', 'abc'), ('abc', 'abd'), ('abc', 'abxc'), ('abxc', 'abc'), ('', 'new'), ('old', ''),
+                 ('hello world', 'hello there world'), ('北京大学', '北京理工大学'), ('abcdef', 'abXdeYf'),
+                 ('a1b2c3', 'a1c3'), ('x', 'y')]
+        for s1, s2 in cases:
+            self.assertEqual(diff_str(s1, s2), legacy_diff_str(s1, s2), (s1, s2))
+
+    def test_ops_rebuild_both_sides(self):
+        a, b = list('kitten sitting'), list('sitting kitten')
+        ops = myers_diff(a, b)
+        self.assertEqual(''.join(t for sign, t in ops if sign != '+'), 'kitten sitting')
+        self.assertEqual(''.join(t for sign, t in ops if sign != '-'), 'sitting kitten')
+
+    def test_max_edits_fallback(self):
+        self.assertIsNone(myers_diff(list('bcdef'), list('xcxex'), max_edits=1))
+        self.assertEqual(diff_str('abcdef', 'axcxef', max_edits=1), 'a<em>bcd</em><strong>xcx</strong>ef')
+        max_edits = compare_diff.DIFF_MAX_EDITS
+        compare_diff.DIFF_MAX_EDITS = 1
+        try:
+            self.assertEqual(diff_str('abcdef', 'axcxef'), 'a<em>bcd</em><strong>xcx</strong>ef')
+        finally:
+            compare_diff.DIFF_MAX_EDITS = max_edits
+        self.assertEqual(diff_str('abcdef', 'axcxef', max_edits=10), 'a<em>b</em><strong>x</strong>c<em>d</em>'
+                                                                      '<strong>x</strong>ef')
+
+    def test_timeout_fallback(self):
+        self.assertIsNone(myers_diff(list('ab'), list('ba'), deadline=time.time() - 1))
+        self.assertEqual(diff_str('abcdef', 'axcxef', timeout=-1), 'a<em>bcd</em><strong>xcx</strong>ef')
+        timeout = compare_diff.DIFF_TIMEOUT
+        compare_diff.DIFF_TIMEOUT = -1
+        try:
+            self.assertEqual(diff_str('old text', 'new text'), '<em>old</em><strong>new</strong> text')
+        finally:
+            compare_diff.DIFF_TIMEOUT = timeout
+
+    def test_long_text_bounded(self):
+        s1 = ' '.join('w%s' % i for i in range(20000))
+        s2 = ' '.join('v%s' % i for i in range(20000))
+        start = time.time()
+        res = diff_str(s1, s2)
+        self.assertLess(time.time() - start, 2)
+        self.assertTrue(res.startswith('<em>w0 ') and res.endswith('v19999</strong>'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+from datetime import datetime, date, timezone
+from mongoengine import Document, EmbeddedDocument, StringField, IntField, DateTimeField, DateField, ListField, \
+    SortedListField, ReferenceField, EmbeddedDocumentField, EmbeddedDocumentListField, DictField
+from ..document import DocumentMixin, get_converters, parse_datetime, copy_cls
+from .base import connect, disconnect
+
+
+class ConvTarget(Document, DocumentMixin):
+    meta = {'collection': 'conv_target'}
+    name = StringField()
+
+
+class ConvInfo(EmbeddedDocument, DocumentMixin):
+    note = StringField()
+    day = DateField()
+
+
+class ConvRestructInfo(EmbeddedDocument, DocumentMixin):
+    _restruct_ = True
+    note = StringField()
+    at = DateTimeField()
+
+
+class ConvItem(Document, DocumentMixin):
+    meta = {'collection': 'conv_item'}
+    name = StringField()
+    count = IntField()
+    at = DateTimeField()
+    day = DateField()
+    times = ListField(DateTimeField())
+    sorted_days = SortedListField(DateField())
+    target = ReferenceField(ConvTarget)
+    targets = ListField(ReferenceField(ConvTarget))
+    info = EmbeddedDocumentField(ConvInfo)
+    restruct = EmbeddedDocumentField(ConvRestructInfo)
+    infos = EmbeddedDocumentListField(ConvInfo)
+    extra = DictField()
+
+
+class ParseDatetimeTest(unittest.TestCase):
+    def test_iso_fast_path(self):
+        self.assertEqual(parse_datetime('2020-01-02T03:04:05'), datetime(2020, 1, 2, 3, 4, 5))
+        self.assertEqual(parse_datetime('2020-01-02 03:04:05.123000'), datetime(2020, 1, 2, 3, 4, 5, 123000))
+        self.assertEqual(parse_datetime('2020-01-02T03:04:05Z'),
+                         datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc))
+
+    def test_fallback_to_dateutil(self):
+        self.assertEqual(parse_datetime('Jan 2 2020 3:04'), datetime(2020, 1, 2, 3, 4))
+        self.assertEqual(parse_datetime('2020/01/02'), datetime(2020, 1, 2))
+
+
+class ConverterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+        ConvTarget.drop_collection()
+        cls.target = ConvTarget(name='t').save()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def convert(self, key, value):
+        return get_converters(ConvItem)[key](value)
+
+    def test_compiled_once_per_class(self):
+        self.assertIs(get_converters(ConvItem), get_converters(ConvItem))
+        copied = copy_cls(ConvItem)
+        self.assertIsNot(get_converters(copied), get_converters(ConvItem))
+
+    def test_scalars_pass_through(self):
+        self.assertEqual(self.convert('name', 'a'), 'a')
+        self.assertEqual(self.convert('count', '3'), '3')
+        extra = {'a': {'b': 1}}
+        self.assertIs(self.convert('extra', extra), extra)
+
+    def test_dates(self):
+        self.assertEqual(self.convert('at', '2020-01-02T03:04:05'), datetime(2020, 1, 2, 3, 4, 5))
+        self.assertEqual(self.convert('at', 'Jan 2 2020'), datetime(2020, 1, 2))
+        self.assertEqual(self.convert('day', '2020-01-02T03:04:05Z'), date(2020, 1, 2))
+        value = datetime(2020, 1, 2)
+        self.assertIs(self.convert('at', value), value)
+        self.assertEqual(self.convert('times', ['2020-01-02', value]), [datetime(2020, 1, 2), value])
+        self.assertEqual(self.convert('sorted_days', ['2020-01-02']), [date(2020, 1, 2)])
+
+    def test_none_values(self):
+        for key in ('at', 'day', 'times', 'target', 'targets', 'info', 'infos', 'name'):
+            self.assertIsNone(self.convert(key, None), key)
+
+    def test_reference(self):
+        target = self.target
+        self.assertEqual(self.convert('target', target.id).name, 't')
+        self.assertEqual(self.convert('target', str(target.id)).name, 't')
+        self.assertEqual([t.id for t in self.convert('targets', [str(target.id), target.id])], [target.id] * 2)
+        built = self.convert('target', {'name': 'new'})
+        self.assertIsInstance(built, ConvTarget)
+        self.assertEqual(built.name, 'new')
+
+    def test_embedded(self):
+        info = self.convert('info', {'note': 'n', 'day': date(2020, 1, 2)})
+        self.assertIsInstance(info, ConvInfo)
+        self.assertEqual(info.note, 'n')
+        # 非 _restruct_ 的嵌入文档直接构造，不转换字符串日期
+        self.assertEqual(self.convert('info', {'day': '2020-01-02'}).day, '2020-01-02')
+        # _restruct_ 的嵌入文档经 create_with 递归转换
+        self.assertEqual(self.convert('restruct', {'at': '2020-01-02T00:00:00'}).at, datetime(2020, 1, 2))
+        # EmbeddedDocumentListField 不在精确分派之内，原样返回
+        infos = [{'note': 'a'}]
+        self.assertIs(self.convert('infos', infos), infos)
+
+    def test_unknown_field(self):
+        with self.assertRaises(Exception) as ctx:
+            ConvItem.create_with({'missing': 1})
+        self.assertIn('err field missing', str(ctx.exception))
+
+    def test_create_with(self):
+        item = ConvItem.create_with({'name': 'a', 'at': '2020-01-02T03:04:05', 'target': str(self.target.id),
+                                     'info': {'note': 'n'}, 'times': None})
+        self.assertEqual(item.at, datetime(2020, 1, 2, 3, 4, 5))
+        self.assertEqual(item.target.id, self.target.id)
+        self.assertEqual(item.info.note, 'n')
+        self.assertEqual(item.times, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
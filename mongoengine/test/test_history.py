@@ -0,0 +1,338 @@
+import datetime
+import unittest
+from mongoengine import Document, EmbeddedDocument, StringField, DateTimeField, EmbeddedDocumentField
+from ..document import DocumentMixin
+from ..history import HistoryMixin, History, HistoryConflictError
+from .base import connect, disconnect
+
+
+class HisInfo(EmbeddedDocument, DocumentMixin):
+    note = StringField()
+
+
+class HisItem(Document, DocumentMixin, HistoryMixin):
+    meta = {'collection': 'his_item'}
+    name = StringField()
+    info = EmbeddedDocumentField(HisInfo)
+    update_time = DateTimeField()
+
+    def clean(self):
+        # clean 中修改嵌入字段
+        if self.info is not None:
+            self.info.note = (self.name or '').upper()
+
+    @classmethod
+    def get_history_document(cls):
+        return HisItemHistory
+
+
+class HisItemHistory(Document, DocumentMixin, History):
+    meta = {'collection': 'his_item_history'}
+    document_type = HisItem
+    create_time = DateTimeField(default=datetime.datetime.utcnow)
+
+
+class HistoryTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        HisItem.drop_collection()
+        HisItemHistory.drop_collection()
+
+
+class SaveWithHistoryTest(HistoryTestCase):
+    def check_saved(self, item, note):
+        raw = HisItem._get_collection().find_one({'_id': item.id})
+        self.assertEqual(raw['info']['note'], note)
+        self.assertEqual(HisItemHistory.get_last(item.id).full_content['info']['note'], note)
+
+    def test_clean_mutates_embedded(self):
+        item = HisItem(name='a', info=HisInfo(note='')).save()
+        item.name = 'b'
+        item.save_with_history(desc='rename')
+        self.check_saved(item, 'B')
+
+    def test_save_clean_mutates_embedded(self):
+        item = HisItem(name='a', info=HisInfo(note='')).save()
+        item.name = 'c'
+        item._save_(desc='rename')
+        self.check_saved(item, 'C')
+
+    def test_unchanged_not_saved(self):
+        item = HisItem(name='a', info=HisInfo(note='A')).save()
+        self.assertIs(item.save_with_history(), item)
+        self.assertEqual(HisItemHistory.objects.count(), 0)
+
+
+class DeltaItem(Document, DocumentMixin, HistoryMixin):
+    meta = {'collection': 'delta_item'}
+    name = StringField()
+    update_time = DateTimeField()
+
+    @classmethod
+    def get_history_document(cls):
+        return DeltaItemHistory
+
+
+class DeltaItemHistory(Document, DocumentMixin, History):
+    meta = {'collection': 'delta_item_history'}
+    document_type = DeltaItem
+    keyframe_interval = 3
+    create_time = DateTimeField(default=datetime.datetime.utcnow)
+
+
+class DeltaHistoryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        DeltaItem.drop_collection()
+        DeltaItemHistory.drop_collection()
+
+    def test_content_is_full(self):
+        item = DeltaItem(name='v0').save()
+        for i in range(1, 5):
+            item.name = 'v%s' % i
+            item.save_with_history(version=str(i))
+        records = list(DeltaItemHistory.objects.order_by('create_time'))
+        self.assertEqual([r.chain for r in records], [0, 1, 2, 0])
+        for i, record in enumerate(records, 1):
+            self.assertEqual(record.content['name'], 'v%s' % i)
+            self.assertEqual(DeltaItemHistory.get_by(str(item.id), str(i)).content['name'], 'v%s' % i)
+        raw = DeltaItemHistory._get_collection().find_one({'_id': records[1].id})
+        self.assertEqual(raw['content'], {'_id': item.id})
+
+    def test_concurrent_chain(self):
+        item = DeltaItem(name='v0').save()
+        last = DeltaItemHistory.snapshot(item.db_dict)
+        first = DeltaItemHistory.snapshot(dict(item.db_dict, name='a'), last=last)
+        second = DeltaItemHistory.snapshot(dict(item.db_dict, name='b'), last=last)
+        self.assertEqual((first.chain, second.chain), (1, 0))
+        self.assertEqual(DeltaItemHistory.objects.get(id=first.id).content['name'], 'a')
+        self.assertEqual(DeltaItemHistory.objects.get(id=second.id).content['name'], 'b')
+
+
+class PlainHistory(Document, History):
+    meta = {'collection': 'plain_history'}
+    create_time = DateTimeField(default=datetime.datetime.utcnow)
+
+
+class HistoryIndexTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def test_index_created(self):
+        PlainHistory.drop_collection()
+        PlainHistory(stored_content={'_id': 1}).save()
+        info = PlainHistory._get_collection().index_information()
+        keys = [tuple(tuple(k) for k in i['key']) for i in info.values()]
+        self.assertIn((('ref_id', 1), ('create_time', -1)), keys)
+        self.assertIn((('keyframe', 1), ('chain', 1)), keys)
+
+    def test_explicit_ensure_indexes(self):
+        PlainHistory.drop_collection()
+        PlainHistory._get_collection().drop_indexes()
+        PlainHistory.ensure_indexes()
+        self.assertEqual(len(PlainHistory._get_collection().index_information()), 3)
+
+
+class DiffTimelineTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        DeltaItem.drop_collection()
+        DeltaItemHistory.drop_collection()
+
+    def make_timeline(self, names, version='same'):
+        item = DeltaItem(name=names[0]).save()
+        for name in names:
+            item.name = name
+            DeltaItemHistory.snapshot(item.db_dict, version=version)
+        return item
+
+    def test_in_process_and_memo_by_record(self):
+        first = self.make_timeline(['a', 'b', 'c'])
+        second = self.make_timeline(['x', 'y'])
+        res = DeltaItemHistory.diff_timeline(first.id)
+        self.assertEqual([list(i['diff']) for i in res], [['name'], ['name']])
+        self.assertNotEqual(res[0]['diff'], res[1]['diff'])
+        # 第二次取自缓存，版本号相同的不同记录不能互相命中
+        self.assertEqual(DeltaItemHistory.diff_timeline(first.id), res)
+        res = DeltaItemHistory.diff_timeline(second.id)
+        self.assertEqual(len(res), 1)
+        self.assertIn('y', res[0]['diff']['name'])
+
+    def test_shared_pool(self):
+        from .. import history
+        item = self.make_timeline(['a', 'b', 'c', 'd'], version=None)
+        threshold = DeltaItemHistory.timeline_pool_threshold
+        DeltaItemHistory.timeline_pool_threshold = 1
+        try:
+            res = DeltaItemHistory.diff_timeline(item.id, max_workers=1)
+            pool = history._timeline_pool
+            self.assertIsNotNone(pool)
+            res2 = DeltaItemHistory.diff_timeline(item.id, mask=['update_time'])
+            self.assertIs(history._timeline_pool, pool)
+        finally:
+            DeltaItemHistory.timeline_pool_threshold = threshold
+        self.assertEqual([i['diff'] for i in res], [i['diff'] for i in res2])
+        self.assertEqual(len(res), 3)
+
+
+class CountedItem(Document, DocumentMixin, HistoryMixin):
+    meta = {'collection': 'counted_item'}
+    name = StringField()
+    info = EmbeddedDocumentField(HisInfo)
+    update_time = DateTimeField()
+    conversions = 0
+
+    def to_mongo(self, use_db_field=True, fields=None):
+        if not fields:
+            CountedItem.conversions += 1
+        return super().to_mongo(use_db_field, fields)
+
+    @classmethod
+    def get_history_document(cls):
+        return CountedItemHistory
+
+
+class CountedItemHistory(Document, DocumentMixin, History):
+    meta = {'collection': 'counted_item_history'}
+    document_type = CountedItem
+    create_time = DateTimeField(default=datetime.datetime.utcnow)
+
+
+class SaveConversionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        CountedItem.drop_collection()
+        CountedItemHistory.drop_collection()
+        CountedItem(name='a', info=HisInfo(note='n')).save()
+        self.item = CountedItem.objects.first()
+        CountedItem.conversions = 0
+
+    def test_save_cycle_conversions(self):
+        # 比较时本对象与库中文档各一次，保存、计算更新、写历史共用一次(不缓存时为 5 次)
+        self.item.name = 'b'
+        self.item._save_()
+        self.assertEqual(CountedItem.conversions, 3)
+        self.assertEqual(CountedItemHistory.get_last(self.item.id).full_content['name'], 'b')
+
+    def test_save_with_history_conversions(self):
+        self.item.info.note = 'm'
+        self.item.save_with_history()
+        self.assertEqual(CountedItem.conversions, 3)
+        self.assertEqual(CountedItem._get_collection().find_one()['info']['note'], 'm')
+        self.assertEqual(CountedItemHistory.get_last(self.item.id).full_content['info']['note'], 'm')
+
+
+class RevItem(Document, DocumentMixin, HistoryMixin):
+    meta = {'collection': 'rev_item'}
+    history_change_detect = 'rev'
+    name = StringField()
+    update_time = DateTimeField()
+
+    @classmethod
+    def get_history_document(cls):
+        return RevItemHistory
+
+
+class RevItemHistory(Document, DocumentMixin, History):
+    meta = {'collection': 'rev_item_history'}
+    document_type = RevItem
+    create_time = DateTimeField(default=datetime.datetime.utcnow)
+
+
+class RevHistoryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        RevItem.drop_collection()
+        RevItemHistory.drop_collection()
+        self.item = RevItem(name='a')
+        self.item._save_()
+
+    def raw_rev(self):
+        return RevItem._get_collection().find_one({'_id': self.item.id})['_rev']
+
+    def test_created(self):
+        self.assertEqual(self.item.history_rev, 1)
+        self.assertEqual(self.raw_rev(), 1)
+        self.assertEqual(RevItemHistory.get_last(self.item.id).full_content['_rev'], 1)
+
+    def test_unchanged_not_written(self):
+        item = RevItem.objects.get(pk=self.item.pk)
+        self.assertIs(item.save_with_history(), item)
+        self.assertIs(item._save_(), item)
+        self.assertEqual(self.raw_rev(), 1)
+        self.assertEqual(RevItemHistory.objects.count(), 1)
+
+    def test_rev_increments(self):
+        item = RevItem.objects.get(pk=self.item.pk)
+        item.name = 'b'
+        item.save_with_history()
+        item.name = 'c'
+        item._save_()
+        self.assertEqual(item.history_rev, 3)
+        self.assertEqual(self.raw_rev(), 3)
+        self.assertEqual(RevItemHistory.objects.count(), 3)
+        self.assertEqual(RevItemHistory.get_last(item.id).full_content['name'], 'c')
+
+    def test_stale_rev_conflict(self):
+        first = RevItem.objects.get(pk=self.item.pk)
+        second = RevItem.objects.get(pk=self.item.pk)
+        first.name = 'b'
+        first._save_()
+        second.name = 'c'
+        with self.assertRaises(HistoryConflictError):
+            second._save_()
+        self.assertEqual(second.history_rev, 1)
+        raw = RevItem._get_collection().find_one({'_id': self.item.id})
+        self.assertEqual((raw['name'], raw['_rev']), ('b', 2))
+        self.assertEqual(RevItemHistory.objects.count(), 2)
+
+    def test_force(self):
+        item = RevItem.objects.get(pk=self.item.pk)
+        item._save_(force=True)
+        self.assertEqual(item.history_rev, 2)
+        self.assertEqual(self.raw_rev(), 2)
+        self.assertEqual(RevItemHistory.objects.count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import threading
+import unittest
+from ..history_writer import HistoryWriter
+from .base import connect, disconnect
+from .test_history import PlainHistory
+
+
+class HistoryWriterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def test_concurrent_put(self):
+        PlainHistory.drop_collection()
+        writer = HistoryWriter(max_size=50, batch_size=20, flush_interval=0.05, put_timeout=0.01)
+
+        def put_many():
+            for i in range(200):
+                writer.put(PlainHistory(stored_content={'_id': i}))
+        threads = [threading.Thread(target=put_many) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertTrue(writer.flush(timeout=10))
+        writer.close()
+        metrics = writer.metrics
+        self.assertEqual(metrics['enqueued'] + metrics['sync_written'], 800)
+        self.assertEqual(metrics['written'], metrics['enqueued'])
+        self.assertEqual(metrics['failed'], 0)
+        self.assertEqual(PlainHistory.objects.count(), 800)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from flask import Flask
+from mongoengine import Document, StringField, BooleanField
+from mongoengine.queryset import queryset_manager
+from ..document import DocumentMixin
+from ..identity_map import identity_map, get_by_pk, get_many_by_pk
+from .base import connect, disconnect
+
+
+class MapItem(Document, DocumentMixin):
+    meta = {'collection': 'map_item'}
+    name = StringField()
+    deleted = BooleanField(default=False)
+
+    @queryset_manager
+    def objects(doc_cls, queryset):
+        return queryset.filter(deleted=False)
+
+
+class IdentityMapTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+        MapItem.drop_collection()
+        cls.alive = MapItem(name='alive').save()
+        cls.deleted = MapItem(name='deleted', deleted=True).save()
+        cls.app = Flask(__name__)
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def test_manager_isolated(self):
+        with self.app.app_context(), identity_map():
+            loaded = get_many_by_pk(MapItem, [self.alive.id, self.deleted.id], manager='ori_objects')
+            self.assertEqual(len(loaded), 2)
+            self.assertRaises(MapItem.DoesNotExist, get_by_pk, MapItem, self.deleted.id)
+            self.assertEqual(get_many_by_pk(MapItem, [self.deleted.id]), {})
+
+    def test_cached_per_manager(self):
+        with self.app.app_context(), identity_map():
+            first = get_by_pk(MapItem, str(self.alive.id))
+            self.assertIs(get_by_pk(MapItem, self.alive.id), first)
+            self.assertIsNot(get_by_pk(MapItem, self.alive.id, manager='ori_objects'), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
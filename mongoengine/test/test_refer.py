@@ -0,0 +1,62 @@
+import unittest
+from mongoengine import Document, EmbeddedDocument, StringField, ReferenceField, ListField, \
+    EmbeddedDocumentField
+from ..document import DocumentMixin
+from .base import connect, disconnect
+
+
+class ReferUser(Document, DocumentMixin):
+    meta = {'collection': 'refer_shared'}
+    name = StringField()
+
+
+class ReferGroup(Document, DocumentMixin):
+    meta = {'collection': 'refer_shared'}
+    title = StringField()
+
+
+class ReferInfo(EmbeddedDocument, DocumentMixin):
+    owner = ReferenceField(ReferUser)
+
+
+class ReferPost(Document, DocumentMixin):
+    meta = {'collection': 'refer_post'}
+    author = ReferenceField(ReferUser)
+    group = ReferenceField(ReferGroup)
+    info = EmbeddedDocumentField(ReferInfo)
+    infos = ListField(EmbeddedDocumentField(ReferInfo))
+
+
+class FillReferTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+        for doc_cls in (ReferUser, ReferPost):
+            doc_cls.drop_collection()
+        cls.user = ReferUser(name='u').save()
+        cls.group = ReferGroup(title='g').save()
+        ReferPost(author=cls.user, group=cls.group, info=ReferInfo(owner=cls.user)).save()
+        ReferPost(author=cls.user, info=None, infos=[ReferInfo(owner=cls.user)]).save()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def test_fill_refer_none_embedded(self):
+        posts = list(ReferPost.objects.order_by('id'))
+        ReferPost.fill_qs_refer(posts, ReferUser)
+        self.assertIsNone(posts[1].info)
+        self.assertEqual(posts[1].infos[0].owner.name, 'u')
+        self.assertEqual(posts[0].info.owner.name, 'u')
+
+    def test_fill_qs_refer_all_shared_collection(self):
+        posts = ReferPost.fill_qs_refer_all(ReferPost.objects.order_by('id'))
+        self.assertIsInstance(posts[0]._data['author'], ReferUser)
+        self.assertIsInstance(posts[0]._data['group'], ReferGroup)
+        self.assertEqual(posts[0]._data['group'].title, 'g')
+        self.assertIsInstance(posts[1]._data['infos'][0]._data['owner'], ReferUser)
+        self.assertIsNone(posts[1]._data['group'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import unittest
+from bson import json_util
+from mongoengine import Document, StringField, ListField
+from .. import search
+from ..search import SearchMixin, SearchReindexer
+from .base import connect, disconnect
+
+
+class SearchItem(Document, SearchMixin):
+    meta = {'collection': 'search_item'}
+    name = StringField()
+    tags = ListField(StringField())
+
+
+class SearchPropItem(Document, SearchMixin):
+    meta = {'collection': 'search_prop_item'}
+    search_fields = ['name', 'display', 'info.note']
+    name = StringField()
+    note = StringField()
+
+    @property
+    def display(self):
+        return 'display'
+
+
+class SearchAllItem(Document, SearchMixin):
+    meta = {'collection': 'search_all_item'}
+    search_fields = ['__all_str__', 'name']
+    name = StringField()
+
+
+class TokenCacheTest(unittest.TestCase):
+    def setUp(self):
+        search.clear_token_cache()
+
+    def test_keyed_by_digest(self):
+        text = '北京大学' * 1000
+        tokens = search.cut_for_search(text)
+        self.assertIs(search.cut_for_search(text), tokens)
+        self.assertEqual(len(search._token_cache), 1)
+        self.assertNotIn(text, search._token_cache)
+        self.assertTrue(all(isinstance(k, bytes) and len(k) == 64 for k in search._token_cache))
+
+    def test_bounded(self):
+        size = search.SEARCH_TOKEN_CACHE_SIZE
+        search.SEARCH_TOKEN_CACHE_SIZE = 2
+        try:
+            for text in ['a', 'b', 'c']:
+                search.cut_for_search(text)
+            self.assertEqual(len(search._token_cache), 2)
+        finally:
+            search.SEARCH_TOKEN_CACHE_SIZE = size
+
+
+class SearchTagsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        SearchItem.drop_collection()
+
+    def test_cache_follows_value_after_save_and_reload(self):
+        item = SearchItem(name='alpha', tags=['x']).save()
+        item.reset_search_tags()
+        self.assertIn('alpha', item.search_tags.split())
+        SearchItem.objects(pk=item.pk).update(set__name='beta')
+        item.reload()
+        item.reset_search_tags()
+        tags = item.search_tags.split()
+        self.assertIn('beta', tags)
+        self.assertNotIn('alpha', tags)
+
+    def test_cache_follows_value_without_changed_fields(self):
+        item = SearchItem(name='alpha').save()
+        item.reset_search_tags()
+        item._data['name'] = 'gamma'
+        item.reset_search_tags()
+        self.assertEqual(item.search_tags.split(), ['gamma'])
+
+
+class SearchReindexerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        SearchItem.drop_collection()
+        self.items = [SearchItem(name='n%s' % i).save() for i in range(5)]
+        self.tmpdir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.tmpdir, 'reindex.json')
+        search.clear_token_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_resume_restores_processed(self):
+        with open(self.checkpoint, 'w') as f:
+            f.write(json_util.dumps({'last_id': self.items[2].pk, 'processed': 3}))
+        stats = SearchReindexer(SearchItem, batch_size=1, processes=0, checkpoint=self.checkpoint).run()
+        self.assertEqual(stats['processed'], 5)
+        self.assertFalse(os.path.exists(self.checkpoint))
+        self.assertIsNone(SearchItem.objects.get(pk=self.items[0].pk).search_tags)
+        self.assertEqual(SearchItem.objects.get(pk=self.items[4].pk).search_tags, 'n4')
+
+    def test_checkpoint_records_processed(self):
+        reindexer = SearchReindexer(SearchItem, batch_size=2, processes=0, checkpoint=self.checkpoint)
+        reindexer.write([(self.items[0].pk, 'n0'), (self.items[1].pk, 'n1')])
+        with open(self.checkpoint) as f:
+            state = json_util.loads(f.read())
+        self.assertEqual(state, {'last_id': self.items[1].pk, 'processed': 2})
+
+    def test_bulk_bypasses_token_cache(self):
+        SearchReindexer(SearchItem, processes=0).run()
+        self.assertEqual(len(search._token_cache), 0)
+
+    def test_only_model_fields(self):
+        SearchPropItem.drop_collection()
+        item = SearchPropItem(name='p', note='x').save()
+        reindexer = SearchReindexer(SearchPropItem, processes=0)
+        self.assertEqual(reindexer.get_only_fields(), ['name'])
+        self.assertEqual(reindexer.run()['processed'], 1)
+        self.assertEqual(SearchPropItem.objects.get(pk=item.pk).search_tags, 'p')
+
+    def test_all_str_loads_all_fields(self):
+        SearchAllItem.drop_collection()
+        SearchAllItem(name='q').save()
+        reindexer = SearchReindexer(SearchAllItem, processes=0)
+        self.assertIsNone(reindexer.get_only_fields())
+        self.assertIsNone(reindexer.get_queryset()._loaded_fields.as_dict() or None)
+        self.assertEqual(reindexer.run()['processed'], 1)
+        self.assertEqual(SearchAllItem.objects.first().search_tags, 'q')
+
+
+if __name__ == '__main__':
+    unittest.main()
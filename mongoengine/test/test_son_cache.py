@@ -0,0 +1,71 @@
+import unittest
+from mongoengine import Document, EmbeddedDocument, StringField, ListField, DictField, EmbeddedDocumentField
+from ..document import DocumentMixin, son_cache
+from .base import connect, disconnect
+
+
+class CacheInfo(EmbeddedDocument, DocumentMixin):
+    note = StringField()
+
+
+class CacheInner(EmbeddedDocument, DocumentMixin):
+    info = EmbeddedDocumentField(CacheInfo)
+
+
+class CacheItem(Document, DocumentMixin):
+    meta = {'collection': 'cache_item'}
+    name = StringField()
+    tags = ListField(StringField())
+    extra = DictField()
+    info = EmbeddedDocumentField(CacheInfo)
+    infos = ListField(EmbeddedDocumentField(CacheInfo))
+    inner = EmbeddedDocumentField(CacheInner)
+
+
+class SonCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        CacheItem.drop_collection()
+        CacheItem(name='a', tags=['x'], extra={'k': {'v': 1}}, info=CacheInfo(note='n'),
+                  infos=[CacheInfo(note='m')], inner=CacheInner(info=CacheInfo(note='i'))).save()
+        self.item = CacheItem.objects.first()
+
+    def test_memoized_in_scope(self):
+        with son_cache():
+            self.assertIs(self.item.to_mongo(), self.item.to_mongo())
+        self.assertNotIn('_son_cache_', self.item.__dict__)
+        self.assertIsNot(self.item.to_mongo(), self.item.to_mongo())
+
+    def test_invalidated_by_changes(self):
+        item = self.item
+        with son_cache():
+            item.db_dict
+            item.name = 'b'
+            self.assertEqual(item.db_dict['name'], 'b')
+            item.tags.append('y')
+            self.assertEqual(item.db_dict['tags'], ['x', 'y'])
+            item.extra['k']['v'] = 2
+            self.assertEqual(item.db_dict['extra'], {'k': {'v': 2}})
+            item.info.note = 'n2'
+            self.assertEqual(item.db_dict['info']['note'], 'n2')
+            item.infos[0].note = 'm2'
+            self.assertEqual(item.db_dict['infos'], [{'note': 'm2'}])
+            item.inner.info.note = 'i2'
+            self.assertEqual(item.db_dict['inner'], {'info': {'note': 'i2'}})
+
+    def test_loading_does_not_touch_cache(self):
+        with son_cache():
+            CacheItem.objects.first().db_dict
+            item = CacheItem.objects.first()
+            self.assertNotIn('_son_cache_', item.__dict__)
+
+
+if __name__ == '__main__':
+    unittest.main()
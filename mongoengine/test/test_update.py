@@ -0,0 +1,66 @@
+import unittest
+from datetime import datetime
+from mongoengine import Document, EmbeddedDocument, StringField, IntField, DictField, DateTimeField, \
+    EmbeddedDocumentField
+from ..document import DocumentMixin
+from .base import connect, disconnect
+
+
+class UpdateProfile(EmbeddedDocument, DocumentMixin):
+    city = StringField()
+    level = IntField()
+
+
+class UpdateItem(Document, DocumentMixin):
+    meta = {'collection': 'update_item'}
+    name = StringField(required=True)
+    age = IntField()
+    extra = DictField()
+    times = DictField(field=DateTimeField())
+    profile = EmbeddedDocumentField(UpdateProfile)
+
+
+class AtomicUpdateTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        connect()
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+
+    def setUp(self):
+        UpdateItem.drop_collection()
+        self.item = UpdateItem(name='a', age=1, extra={'x': {'y': 1}}, times={'t': datetime(2020, 1, 1)},
+                               profile=UpdateProfile(city='c', level=1)).save()
+
+    def raw(self):
+        return UpdateItem._get_collection().find_one({'_id': self.item.id})
+
+    def test_invalid_value_not_written(self):
+        self.assertRaises(Exception, self.item.update_with, {'name': 'b', 'age': 'notint'}, atomic=True)
+        self.assertEqual(self.raw()['age'], 1)
+        self.assertEqual(self.raw()['name'], 'a')
+        self.assertRaises(Exception, self.item.update_with, {'profile': {'level': 'x'}}, atomic=True)
+        self.assertEqual(self.raw()['profile']['level'], 1)
+
+    def test_required_unset(self):
+        self.assertRaises(Exception, self.item.update_with, {'name': None}, atomic=True)
+        self.assertEqual(self.raw()['name'], 'a')
+
+    def test_minimal_update(self):
+        update = self.item.update_with({'age': 2, 'name': 'a', 'extra': {'x': {'z': 2}},
+                                        'profile': {'level': 3}}, atomic=True)
+        self.assertEqual(update, {'$set': {'age': 2, 'extra.x.z': 2, 'profile.level': 3}})
+        raw = self.raw()
+        self.assertEqual((raw['age'], raw['extra'], raw['profile']['level']), (2, {'x': {'y': 1, 'z': 2}}, 3))
+        self.assertEqual(self.item.extra, {'x': {'y': 1, 'z': 2}})
+
+    def test_dict_values_to_mongo(self):
+        update = self.item.update_with({'times': {'u': '2021-02-03 04:05:06'}}, atomic=True)
+        self.assertEqual(update, {'$set': {'times.u': datetime(2021, 2, 3, 4, 5, 6)}})
+        self.assertEqual(self.raw()['times']['u'], datetime(2021, 2, 3, 4, 5, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
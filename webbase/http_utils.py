@@ -17,7 +17,14 @@ MODEL_HANDLERS = []
 
 try:
     from mongoengine import Document as MongoDocument
-    MODEL_HANDLERS.append((MongoDocument, lambda x, y: x.objects.get(**y)))
+    from ..mongoengine.identity_map import get_by_pk
+
+    def _get_mongo_object(model, kwargs):
+        # 仅按主键查询时走请求级 identity map
+        if len(kwargs) == 1 and ('pk' in kwargs or 'id' in kwargs):
+            return get_by_pk(model, list(kwargs.values())[0])
+        return model.objects.get(**kwargs)
+    MODEL_HANDLERS.append((MongoDocument, _get_mongo_object))
 except Exception as e:
     pass
 try:
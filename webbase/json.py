@@ -1,16 +1,96 @@
-# import json
-from flask import json
+import logging
+import json as _stdjson
+from uuid import UUID
+from decimal import Decimal
 from datetime import date, datetime
 from bson import ObjectId
+from ..flex import current_flex
+logger = logging.getLogger(__name__)
 
+"""
+    json编码后端，通过 current_flex.json_backend 选择：
+        std     标准库 json + JSONEncoder（默认）
+        orjson  需安装 orjson
+        ujson   需安装 ujson
+    各后端保持字典原有的键顺序，对 datetime/date/ObjectId/Decimal 的处理均走 JSONEncoder.default，保证输出一致；
+    第三方后端无法处理的数据（如超过64位的整数）退回标准库编码。
+"""
 
-class JSONEncoder(json.JSONEncoder):
+
+class JSONEncoder(_stdjson.JSONEncoder):
     def default(self, o):
         if isinstance(o, (datetime, date)):
             return o.isoformat()
-        elif isinstance(o, ObjectId):
+        elif isinstance(o, (ObjectId, UUID)):
             return str(o)
+        elif isinstance(o, Decimal):
+            # 与 ujson 原生编码一致，按数值输出
+            return float(o)
         else:
-            return json.JSONEncoder.default(self, o)
+            return _stdjson.JSONEncoder.default(self, o)
+
+
+class StdJSONBackend(object):
+    name = 'std'
+
+    def dumps(self, obj):
+        return _stdjson.dumps(obj, cls=JSONEncoder, sort_keys=False)
+
+
+class OrjsonBackend(StdJSONBackend):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._dumps = orjson.dumps
+        self._option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        self._default = JSONEncoder().default
+
+    def dumps(self, obj):
+        try:
+            return self._dumps(obj, default=self._default, option=self._option).decode('utf-8')
+        except TypeError:
+            return super(OrjsonBackend, self).dumps(obj)
+
+
+class UjsonBackend(StdJSONBackend):
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._dumps = ujson.dumps
+        self._default = JSONEncoder().default
+
+    def dumps(self, obj):
+        try:
+            return self._dumps(obj, default=self._default, ensure_ascii=False)
+        except (TypeError, OverflowError):
+            return super(UjsonBackend, self).dumps(obj)
+
+
+JSON_BACKENDS = {
+    'std': StdJSONBackend,
+    'orjson': OrjsonBackend,
+    'ujson': UjsonBackend,
+}
+_backend_instances = {}
+
+
+def register_json_backend(name, backend_cls):
+    JSON_BACKENDS[name] = backend_cls
+    _backend_instances.pop(name, None)
+
+
+def get_json_backend(name=None):
+    name = name or current_flex.get('json_backend') or 'std'
+    if name not in _backend_instances:
+        try:
+            _backend_instances[name] = JSON_BACKENDS[name]()
+        except (KeyError, ImportError) as e:
+            logger.warning('json backend %s unavailable, fall back to std: %s' % (name, e))
+            _backend_instances[name] = StdJSONBackend()
+    return _backend_instances[name]
 
 
+def dumps(obj):
+    return get_json_backend().dumps(obj)
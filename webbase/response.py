@@ -1,11 +1,11 @@
-import json
+from flask import stream_with_context
 from flask.wrappers import Response
-from .json import JSONEncoder
+from .json import dumps
 from werkzeug.exceptions import BadRequest, HTTPException
 
 
 def json_dumps(data):
-    return json.dumps(data, cls=JSONEncoder)
+    return dumps(data)
 
 
 class JsonResponse(Response):
@@ -54,17 +54,66 @@ class ErrResponse(JsonResponse):
         super(ErrResponse, self).__init__(res, status=status)
 
 
+def get_total_page(total, page_size):
+    if page_size < -1:
+        raise BadRequest('page_size(页长)不能小于-1')
+    return int((total - 1) / page_size) + 1 if page_size != -1 else 1
+
+
+_NO_CURSOR = object()
+
+
+def table_info(message, page, total, page_size, next_cursor=_NO_CURSOR, total_capped=None):
+    """表格信封中data之外的信息，只有游标分页时才输出 next_cursor，只有传入 total_capped 时才输出 total_capped"""
+    res = {'message': message, 'current_page': page}
+    if next_cursor is not _NO_CURSOR:
+        res['next_cursor'] = next_cursor
+    res['total'] = total
+    if total_capped is not None:
+        res['total_capped'] = total_capped
+    res['total_page'] = get_total_page(total, page_size)
+    return res
+
+
 class TableResponse(JsonResponse):
     DEFAULT_PAGE_SIZE = 20
 
-    def __init__(self, data=[], page=1, total=0, page_size=20, message=''):
-        if page_size < -1:
-            raise BadRequest('page_size(页长)不能小于-1')
-        res = {'code': 0, 'data': data, 'message': message, 'current_page': page,
-               'total': total, 'total_page': int((total - 1) / page_size) + 1 if page_size != '-1' else 1}
+    def __init__(self, data=[], page=1, total=0, page_size=20, message='', next_cursor=_NO_CURSOR,
+                 total_capped=None):
+        """
+        :param next_cursor: 游标分页(model_cursor_paginate)返回的下一页游标，没有下一页时为None；
+                            不传时响应中不含 next_cursor
+        :param total_capped: 计数上限策略(count_mode='capped')下 total 是否被截断
+        """
+        res = {'code': 0, 'data': data}
+        res.update(table_info(message, page, total, page_size, next_cursor, total_capped))
         super(JsonResponse, self).__init__(response=json_dumps(res))
 
 
+class StreamTableResponse(Response):
+    """
+        流式表格响应，信封格式与 TableResponse 一致。
+        serializer 持有查询集(游标)，按块序列化后逐条输出json片段，内存占用不随结果数量增长。
+        适用于 page_size=-1 等大结果集：
+            objs = model_order_paginate(model_class, objs, pargs, lazy=True)
+            return StreamTableResponse(Serializer(objs), page=pargs.page, total=total, page_size=pargs.page_size)
+    """
+    def __init__(self, serializer, page=1, total=0, page_size=20, message='', chunk_size=500, next_cursor=_NO_CURSOR,
+                 total_capped=None):
+        head = json_dumps({'code': 0})[:-1] + ', "data": ['
+        tail = '], ' + json_dumps(table_info(message, page, total, page_size, next_cursor, total_capped))[1:]
+
+        def generate():
+            yield head
+            sep = ''
+            for item in serializer.iter_data(chunk_size=chunk_size):
+                yield sep + json_dumps(item)
+                sep = ', '
+            yield tail
+        super(StreamTableResponse, self).__init__(response=stream_with_context(generate()),
+                                                  content_type='application/json')
+
+
 class ActionError(HTTPException):
     def __init__(self, message=''):
         super(ActionError, self).__init__(response=FailedResponse(message, status=400))
@@ -0,0 +1,46 @@
+import time
+from uuid import uuid4
+from decimal import Decimal
+from datetime import datetime, date
+from bson import ObjectId
+from ..json import JSON_BACKENDS
+
+"""
+    各json后端的编码吞吐，未安装的后端跳过：python -m <package>.webbase.test.bench_json
+"""
+
+
+def make_payload(rows=1000):
+    now = datetime(2020, 1, 2, 3, 4, 5)
+    return {
+        'message': '列表', 'total': rows, 'page': 1, 'page_size': rows,
+        'data': [{'id': ObjectId(), 'name': 'name %s' % i, 'count': i, 'score': i / 3, 'active': bool(i % 2),
+                  'price': Decimal('%s.25' % i), 'uuid': uuid4(), 'create_time': now, 'day': date(2020, 1, 2),
+                  'tags': ['a', 'b', 'c'], 'profile': {'city': '北京', 'level': i % 5, 'note': None}}
+                 for i in range(rows)],
+    }
+
+
+def bench(rows=1000, number=20, repeat=3):
+    """:return: {后端名: 每秒编码的数据条数}"""
+    payload = make_payload(rows)
+    results = {}
+    for name, backend_cls in JSON_BACKENDS.items():
+        try:
+            backend = backend_cls()
+        except ImportError:
+            continue
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                backend.dumps(payload)
+            cost = time.perf_counter() - start
+            best = cost if best is None else min(best, cost)
+        results[name] = rows * number / best
+    return results
+
+
+if __name__ == '__main__':
+    for name, rate in bench().items():
+        print('%-10s %10.0f rows/s' % (name, rate))
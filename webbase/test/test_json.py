@@ -0,0 +1,57 @@
+import json
+import unittest
+from uuid import UUID
+from decimal import Decimal
+from collections import OrderedDict
+from datetime import date, datetime
+from bson import ObjectId
+from ..json import JSON_BACKENDS, get_json_backend
+
+
+def available_backends():
+    backends = {}
+    for name, backend_cls in JSON_BACKENDS.items():
+        try:
+            backends[name] = backend_cls()
+        except ImportError:
+            pass
+    return backends
+
+
+class JSONBackendConformanceTest(unittest.TestCase):
+    """各后端输出解析后须与标准库后端一致，包括键顺序"""
+    def assertConform(self, obj):
+        backends = available_backends()
+        expected = json.loads(backends['std'].dumps(obj), object_pairs_hook=list)
+        for name, backend in backends.items():
+            self.assertEqual(json.loads(backend.dumps(obj), object_pairs_hook=list), expected, name)
+        return expected
+
+    def test_key_order(self):
+        data = OrderedDict([('z', 1), ('a', 2), ('m', {'y': 1, 'b': 2})])
+        self.assertEqual(self.assertConform(data), [('z', 1), ('a', 2), ('m', [('y', 1), ('b', 2)])])
+
+    def test_datetime(self):
+        data = {'dt': datetime(2020, 1, 2, 3, 4, 5, 123456), 'd': date(2020, 1, 2)}
+        self.assertEqual(self.assertConform(data), [('dt', '2020-01-02T03:04:05.123456'), ('d', '2020-01-02')])
+
+    def test_object_id(self):
+        oid = ObjectId()
+        self.assertEqual(self.assertConform({'id': oid, 'ids': [oid]}), [('id', str(oid)), ('ids', [str(oid)])])
+
+    def test_decimal(self):
+        self.assertEqual(self.assertConform({'price': Decimal('1.10')}), [('price', 1.1)])
+
+    def test_uuid_and_unicode(self):
+        data = {'u': UUID(int=1), 's': '中文'}
+        self.assertEqual(self.assertConform(data), [('u', str(UUID(int=1))), ('s', '中文')])
+
+    def test_big_int_fallback(self):
+        self.assertEqual(self.assertConform({'n': 2 ** 70}), [('n', 2 ** 70)])
+
+    def test_unknown_backend(self):
+        self.assertEqual(get_json_backend('not-exist').name, 'std')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+import json
+import unittest
+from ..response import TableResponse
+
+
+class TableResponseTest(unittest.TestCase):
+    def test_without_cursor(self):
+        res = json.loads(TableResponse([1], page=1, total=1, page_size=20).get_data(as_text=True))
+        self.assertNotIn('next_cursor', res)
+        self.assertEqual(res['total_page'], 1)
+
+    def test_cursor(self):
+        res = json.loads(TableResponse([1], total=1, next_cursor='abc').get_data(as_text=True))
+        self.assertEqual(res['next_cursor'], 'abc')
+        res = json.loads(TableResponse([1], total=1, next_cursor=None).get_data(as_text=True))
+        self.assertIn('next_cursor', res)
+        self.assertIsNone(res['next_cursor'])
+
+
+if __name__ == '__main__':
+    unittest.main()